@@ -1,103 +1,167 @@
-from piece import *
-
-suku = Piece('suku', [3,3,3,3])
-suku.load_processed('Onset_time', 'Cycle_number', 'Metric_location', 'Metric_location_index', 'Is_included_in_grid', 'Phase')
+import argparse
+import os
+import sys
+from pathlib import Path
 
-manjanin = Piece('manjanin', [3,3,3,3])
-manjanin.load_processed('onsets_time', 'cycle', 'subdivision', 'subdivision_index', 'is_valid_subdivision_assignment', 'relative_location_within_the_cycle_democratic')
-
-maraka = Piece('maraka', [3,3,3,3])
-maraka.load_processed('onsets_time', 'cycle', 'subdivision', 'subdivision_index', 'is_valid_subdivision_assignment', 'relative_location_within_the_cycle_democratic')
+from piece import *
+from render import render
+import profiling
+import scheduler
+
+# Column names used by the processed Candombe-table .csv files (manjanin, maraka, woloso)
+CANDOMBE_COLUMNS = ('onsets_time', 'cycle', 'subdivision', 'subdivision_index', 'is_valid_subdivision_assignment', 'relative_location_within_the_cycle_democratic')
+
+# Analyses which can be run from the command line, in the order they are listed in the help
+ANALYSES = ['mle', 'stats', 'histogram', 'tempo', 'rhythm', 'asynchrony']
+
+# Registry of all pieces, keyed by name
+# Each piece declares its beat divisions and column mapping, but its data is only loaded the first time it is used
+pieces = {}
+
+# Arguments for each analysis of each piece, keyed by name and then analysis
+# Pieces only support the tempo and rhythm analyses if they have arguments for them, and the asynchrony analysis if they are processed
+analysis_args = {}
+
+# Names of the registered pieces whose normalized data load_processed caches on disk (see cache.py)
+cached_pieces = set()
+
+# Adds a piece to the registry and returns it
+# processed is a tuple of column names passed to load_processed, or onset is the column name passed to load_from_onsets
+# tempo is an optional tuple of the beat instrument and tempo cutoff (None to search for the best one) passed to tempo, rhythm is an optional instrument passed to rhythm_sequence,
+# and histogram is an optional dictionary of arguments passed to plot_histogram
+def register(name, beat_divisions, mixture_metric_locations=None, processed=None, onset=None, tempo=None, rhythm=None, histogram=None):
+    piece = Piece(name, beat_divisions, mixture_metric_locations)
+    if processed:
+        piece.defer('load_processed', *processed)
+        cached_pieces.add(name)
+    else:
+        piece.defer('load_from_onsets', onset)
+    pieces[name] = piece
+    analysis_args[name] = {'mle': {}, 'stats': {}, 'histogram': histogram or {}}
+    if processed:
+        # Only processed pieces have several instruments playing in each take
+        analysis_args[name]['asynchrony'] = {}
+    if tempo:
+        analysis_args[name]['tempo'] = {'beat_instrument': tempo[0], 'tempo_cutoff': tempo[1]}
+    if rhythm:
+        analysis_args[name]['rhythm'] = {'instrument': rhythm}
+    return piece
+
+# Loads the given pieces (or all registered pieces) now rather than on first use
+# If background is True, each piece loads in its own thread and the threads are returned
+def preload(names=None, background=False):
+    names = names if names is not None else list(pieces)
+    return [pieces[name].load(background) for name in names]
+
+suku = register('suku', [3,3,3,3], processed=('Onset_time', 'Cycle_number', 'Metric_location', 'Metric_location_index', 'Is_included_in_grid', 'Phase'), tempo=('Jembe-2', 95), rhythm='Jembe-1')
+manjanin = register('manjanin', [3,3,3,3], processed=CANDOMBE_COLUMNS, tempo=('Jembe2', 95.5), rhythm='Jembe1')
+maraka = register('maraka', [3,3,3,3], processed=CANDOMBE_COLUMNS, tempo=('Jembe2', 93), rhythm='Jembe1')
+woloso = register('woloso', [3,3,3,3], processed=CANDOMBE_COLUMNS, tempo=('Jembe2', 75), rhythm='Jembe1')
+blue_danube = register('blue-danube', [2,2,2], [1], onset='TIME', histogram={'separately': True})
+waltz_auto = register('waltz-auto', [2,2,2], onset='Onset', histogram={'separately': True})
+waltz_manual = register('waltz-manual', [2,2,2], onset='Onset', histogram={'separately': True})
+
+# Saves every figure used in the report, drawing them in parallel worker processes and skipping any whose data is unchanged (see render.render)
+# The arguments of each figure come from the registry, so they always match those used by the CLI
+def save_all(save_format='.pgf', output_dir='.'):
+    return render([
+        (suku, 'plot_histogram', analysis_args['suku']['histogram']),
+        (suku, 'tempo', analysis_args['suku']['tempo']),
+        (manjanin, 'tempo', analysis_args['manjanin']['tempo']),
+        (waltz_auto, 'plot_histogram', {**analysis_args['waltz-auto']['histogram'], 'figsize': (6.5,2)}),
+    ], save_format, output_dir, latex=save_format == '.pgf')
+
+# Shortcuts for running each analysis of a piece interactively, with the same arguments as the CLI (see analysis_args)
+def _plot(name):
+    pieces[name].plot_histogram(**analysis_args[name]['histogram'])
+
+def _plot_save(name, **kwargs):
+    enable_latex_output()
+    pieces[name].plot_histogram(**analysis_args[name]['histogram'], **kwargs, save_format='.pgf')
+    disable_latex_output()
+    pieces[name].plot_histogram(**analysis_args[name]['histogram'], **kwargs)
 
-woloso = Piece('woloso', [3,3,3,3])
-woloso.load_processed('onsets_time', 'cycle', 'subdivision', 'subdivision_index', 'is_valid_subdivision_assignment', 'relative_location_within_the_cycle_democratic')
+def _tempo(name):
+    pieces[name].tempo(**analysis_args[name]['tempo'])
 
-blue_danube = Piece('blue-danube', [2,2,2], [1])
-blue_danube.load_from_onsets('TIME')
+def _tempo_save(name):
+    enable_latex_output()
+    pieces[name].tempo(**analysis_args[name]['tempo'], save_format='.pgf')
+    disable_latex_output()
+    pieces[name].tempo(**analysis_args[name]['tempo'])
 
-waltz_auto = Piece('waltz-auto', [2,2,2])
-waltz_auto.load_from_onsets('Onset')
+def _rhythm(name, num_of_samples, int_output=True, instrument=None):
+    print(pieces[name].rhythm_sequence(instrument or analysis_args[name]['rhythm']['instrument'], num_of_samples, int_output))
 
-waltz_manual = Piece('waltz-manual', [2,2,2])
-waltz_manual.load_from_onsets('Onset')
 
 # Suku
 def suku_plot():
-    suku.plot_histogram()
+    _plot('suku')
 
 def suku_save():
-    enable_latex_output()
-    suku.plot_histogram(save_format='.pgf')
-    disable_latex_output()
-    suku.plot_histogram()
+    _plot_save('suku')
 
 def suku_tempo():
-    suku.tempo('Jembe-2', 95)
+    _tempo('suku')
 
 def suku_tempo_save():
-    enable_latex_output()
-    suku.tempo('Jembe-2', 95, save_format='.pgf')
-    disable_latex_output()
-    suku.tempo('Jembe-2', 95)
+    _tempo_save('suku')
 
 def suku_mle():
     suku.print_mle()
 
-def suku_rhythm(num_of_samples, int_output=True, instrument='Jembe-1'):
-    print(suku.rhythm_sequence(instrument, num_of_samples, int_output))
+def suku_rhythm(num_of_samples, int_output=True, instrument=None):
+    _rhythm('suku', num_of_samples, int_output, instrument)
 
 
 # Manjanin
 def manjanin_plot():
-    manjanin.plot_histogram()
+    _plot('manjanin')
 
 def manjanin_tempo():
-    manjanin.tempo('Jembe2', 95.5)
+    _tempo('manjanin')
 
 def manjanin_tempo_save():
-    enable_latex_output()
-    manjanin.tempo('Jembe2', 95.5, save_format='.pgf')
-    disable_latex_output()
-    manjanin.tempo('Jembe2', 95.5)
+    _tempo_save('manjanin')
 
 def manjanin_mle():
     manjanin.print_mle()
 
-def manjanin_rhythm(num_of_samples, int_output=True, instrument='Jembe1'):
-    print(manjanin.rhythm_sequence(instrument, num_of_samples, int_output))
+def manjanin_rhythm(num_of_samples, int_output=True, instrument=None):
+    _rhythm('manjanin', num_of_samples, int_output, instrument)
 
 
 # Maraka
 def maraka_plot():
-    maraka.plot_histogram()
+    _plot('maraka')
 
 def maraka_tempo():
-    maraka.tempo('Jembe2', 93)
+    _tempo('maraka')
 
 def maraka_mle():
     maraka.print_mle()
 
-def maraka_rhythm(num_of_samples, int_output=True, instrument='Jembe1'):
-    print(maraka.rhythm_sequence(instrument, num_of_samples, int_output))
+def maraka_rhythm(num_of_samples, int_output=True, instrument=None):
+    _rhythm('maraka', num_of_samples, int_output, instrument)
 
 
 # Woloso
 def woloso_plot():
-    woloso.plot_histogram()
+    _plot('woloso')
 
 def woloso_tempo():
-    woloso.tempo('Jembe2', 75)
+    _tempo('woloso')
 
 def woloso_mle():
     woloso.print_mle()
 
-def woloso_rhythm(num_of_samples, int_output=True, instrument='Jembe1'):
-    print(woloso.rhythm_sequence(instrument, num_of_samples, int_output))
+def woloso_rhythm(num_of_samples, int_output=True, instrument=None):
+    _rhythm('woloso', num_of_samples, int_output, instrument)
 
 
 # Blue Danube
 def blue_danube_plot():
-    blue_danube.plot_histogram(separately=True)
+    _plot('blue-danube')
 
 def blue_danube_mle():
     blue_danube.print_mle()
@@ -105,27 +169,103 @@ def blue_danube_mle():
 
 # Waltz (automatic beat tracking)
 def waltz_auto_plot():
-    waltz_auto.plot_histogram(separately=True)
+    _plot('waltz-auto')
 
 def waltz_auto_save():
-    enable_latex_output()
-    waltz_auto.plot_histogram(separately=True, save_format='.pgf', figsize=(6.5,2))
-    disable_latex_output()
-    waltz_auto.plot_histogram(separately=True, figsize=(6.5,2))
+    _plot_save('waltz-auto', figsize=(6.5,2))
 
 def waltz_auto_mle():
     waltz_auto.print_mle()
 
 def waltz_auto_stats():
-    waltz_auto.statistical_test(1)
+    print(waltz_auto.statistical_test(1))
 
 
 # Waltz (manual beat tracking)
 def waltz_manual_plot():
-    waltz_manual.plot_histogram(separately=True)
+    _plot('waltz-manual')
 
 def waltz_manual_mle():
     waltz_manual.print_mle()
 
 def waltz_manual_stats():
-    waltz_manual.statistical_test(1)
+    print(waltz_manual.statistical_test(1))
+
+
+# Loads a processed piece in a worker process, so that its normalized data is cached on disk before the analyses which depend on it read it
+def _load_task(name):
+    pieces[name].load()
+
+# Runs one analysis of a piece in a worker process and writes its output to output_dir, returning the path written
+# Tables are written as .csv files, and histograms as figures in save_format
+# Rhythm sequences are drawn from a RandomState seeded with seed, so outputs are reproducible
+# Every analysis runs with processes=1, as the task is already running in a worker process and should not start a pool of its own
+def _analysis_task(name, analysis, output_dir, num_of_samples, save_format, seed=0):
+    piece = pieces[name]
+    args = analysis_args[name][analysis]
+    path = Path(output_dir) / f'{name}-{analysis}.csv'
+    if analysis == 'mle':
+        table = piece.mle(processes=1)
+    elif analysis == 'stats':
+        table = piece.location_stats(by=['File'])
+    elif analysis == 'tempo':
+        table = piece.tempo_fits(**args, processes=1).drop(columns=['Covariance', 'Residuals'])
+    elif analysis == 'asynchrony':
+        table = piece.asynchrony_stats()
+    elif analysis == 'rhythm':
+        table = pd.DataFrame({'Pattern': piece.rhythm_sequence(args['instrument'], num_of_samples, int_output=True, random_state=np.random.RandomState(seed))})
+    else:
+        piece.plot_histogram(**args, save_format=save_format, output_dir=output_dir, show=False, processes=1)
+        plt.close('all')
+        return str(piece.figure_path('plot_histogram', save_format, output_dir))
+    table.to_csv(path, index=analysis == 'tempo')
+    return str(path)
+
+def _init_worker():
+    matplotlib.use('Agg')
+
+# Runs analyses for several pieces concurrently across all cores, each in its own worker process which loads the piece itself
+# Processed pieces are first loaded by a task of their own, which normalizes their .csv files once and caches the result on disk,
+# so that their analyses read the cache rather than each parsing the files. Other pieces have no disk cache, so their analyses start straight away
+# Analyses which a piece does not support (e.g. tempo for pieces without a beat instrument) are skipped
+# Returns a dictionary mapping each task name to the path of its output, or the exception it raised
+def run_analyses(names, analyses, output_dir='results', num_of_samples=100, save_format='.png', processes=None, seed=0):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    tasks = {}
+    for name in names:
+        dependencies = []
+        if name in cached_pieces and pieces[name].use_cache:
+            tasks[f'{name}:load'] = (_load_task, (name,), [])
+            dependencies = [f'{name}:load']
+        for analysis in analyses:
+            if analysis in analysis_args[name]:
+                tasks[f'{name}:{analysis}'] = (_analysis_task, (name, analysis, output_dir, num_of_samples, save_format, seed), dependencies)
+    results = scheduler.run(tasks, processes, initializer=_init_worker)
+    return {task: result for task, result in results.items() if not task.endswith(':load') or isinstance(result, Exception)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run micro-timing analyses for every registered piece (or a selection), writing tables and figures to a directory')
+    parser.add_argument('--pieces', nargs='+', choices=list(pieces), default=list(pieces))
+    parser.add_argument('--analyses', nargs='+', choices=ANALYSES, default=ANALYSES)
+    parser.add_argument('--output', default='results', help='directory to write outputs to')
+    parser.add_argument('--samples', type=int, default=100, help='number of cycles to generate for rhythm analysis')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for rhythm analysis')
+    parser.add_argument('--format', default='.png', help='file format for figures, e.g. .png or .pgf')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default all cores)')
+    parser.add_argument('--profile', help='JSON-lines file to record the time, rows and memory of each stage of every analysis to (see profiling.py)')
+    args = parser.parse_args()
+    if args.profile:
+        # Worker processes enable profiling from the environment when they import it
+        os.environ['PROFILE_LOG'] = args.profile
+        profiling.enable(args.profile)
+
+    failed = False
+    for task, result in run_analyses(args.pieces, args.analyses, args.output, args.samples, args.format, args.processes, args.seed).items():
+        if isinstance(result, Exception):
+            failed = True
+            print(f'{task}: failed ({result})', file=sys.stderr)
+        else:
+            print(f'{task}: {result}')
+    if args.profile:
+        print(profiling.summary(by_piece=True, log_path=args.profile).to_string(index=False))
+    sys.exit(1 if failed else 0)
@@ -1,34 +1,160 @@
 # Use FMP to estimate locations of beats for waltz
-# Usage: python beattrack.py <path_to_audio> <tempo_estimate>
+# Usage: python beattrack.py <path_to_audio_or_directory> [<tempo_estimate> ...] [--penalty <factor> ...] [--min-bpm <bpm>] [--max-bpm <bpm>] [--prior-bpm <bpm>] [--processes <n>] [--corpus]
+# If no tempo estimate is given, one is inferred for each file from its novelty function, between --min-bpm and --max-bpm (favouring --prior-bpm if given)
+# Every audio file in a directory is tracked, spread over a pool of processes
+# Giving several tempo estimates or penalty factors tracks every combination of them, saving each with its tempo and penalty in its name
+# With --corpus, the beats are added to data/waltz-auto.corpus (see corpus.py) instead of being saved as text files, and are read alongside the .csv files
+# The tempo estimate used is stored with the beats, in the corpus metadata or as a comment at the top of the text file
 # Adapted from https://www.audiolabs-erlangen.de/resources/MIR/FMP/C6/C6S3_BeatTracking.html
 
-import sys
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 from pathlib import Path
 
 import libfmp.c6
 import librosa
 import numpy as np
+import pandas as pd
+
+import corpus
+
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.flac', '.ogg', '.m4a']
+
+# Resampled novelty functions are cached here, keyed by a hash of the audio file's contents and NOVELTY_PARAMS,
+# so changing the tempo estimate or penalty factor does not recompute the spectrum
+NOVELTY_CACHE_DIR = Path('cache') / 'novelty'
+NOVELTY_PARAMS = {'samplerate': 22050, 'N': 2048, 'H': 512, 'gamma': 100, 'M': 10, 'feature_rate': 100}
 
 def convert_tempo(tempo):
   return (1/tempo) * 60 * 100
 
-audio_path = Path(sys.argv[1])
-title = audio_path.stem
-tempo_est = int(sys.argv[2])
+# Private function which returns the path of the cached novelty function for an audio file
+def _novelty_path(audio_path):
+  digest = hashlib.sha256(Path(audio_path).read_bytes())
+  digest.update(json.dumps(NOVELTY_PARAMS, sort_keys=True).encode())
+  return NOVELTY_CACHE_DIR / (digest.hexdigest()[:32] + '.npz')
+
+# Returns the novelty function of an audio file resampled to NOVELTY_PARAMS['feature_rate'], along with its feature rate
+# The result is read from the cache if the same audio has been processed before
+def novelty(audio_path):
+  cache_path = _novelty_path(audio_path)
+  if cache_path.exists():
+    cached = np.load(cache_path)
+    return cached['novelty'], float(cached['feature_rate'])
+
+  audio_series, _ = librosa.load(str(audio_path), sr=NOVELTY_PARAMS['samplerate'])
+  novelty_function, feature_rate = libfmp.c6.compute_novelty_spectrum(audio_series, Fs=NOVELTY_PARAMS['samplerate'], N=NOVELTY_PARAMS['N'], H=NOVELTY_PARAMS['H'], gamma=NOVELTY_PARAMS['gamma'], M=NOVELTY_PARAMS['M'], norm=True)
+  novelty_function, feature_rate = libfmp.c6.resample_signal(novelty_function, Fs_in=feature_rate, Fs_out=NOVELTY_PARAMS['feature_rate'])
+
+  NOVELTY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+  np.savez(cache_path, novelty=novelty_function, feature_rate=feature_rate)
+  return novelty_function, feature_rate
+
+# Peaks of the autocorrelation at least this fraction of the highest one are strong enough to be the beat period
+STRONG_PEAK_RATIO = 0.8
+
+# Estimates the tempo in BPM of a novelty function from its autocorrelation (a tempogram summarised over the whole recording)
+# Multiples of the beat period correlate as well as the period itself, so the shortest lag with a strong peak (see STRONG_PEAK_RATIO) is chosen,
+# rather than the highest peak, which is often at two or three times the period
+# Only tempi between min_bpm and max_bpm are considered, optionally weighted by a log-normal prior (one octave wide) around prior_bpm,
+# and the peak is interpolated between lags for a finer estimate
+def estimate_tempo(novelty_function, feature_rate, min_bpm=60, max_bpm=240, prior_bpm=None):
+  novelty_function = novelty_function - novelty_function.mean()
+  n = len(novelty_function)
+  spectrum = np.fft.rfft(novelty_function, 2 * n)
+  autocorrelation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2)[:n]
+  # Normalise by the number of overlapping samples, so long lags are not penalised
+  autocorrelation /= n - np.arange(n)
+  # Peaks are compared after summing over neighbouring lags, so a period which is not a whole number of samples (e.g. 33.3 at 180 BPM)
+  # is not weaker than its multiples for being split between two lags
+  smoothed = np.convolve(autocorrelation, np.ones(3), mode='same')
+
+  lags = np.arange(max(int(np.ceil(feature_rate * 60 / max_bpm)), 1), min(int(feature_rate * 60 / min_bpm), n - 2) + 1)
+  if len(lags) == 0:
+    raise ValueError(f'Novelty function is too short to estimate a tempo between {min_bpm} and {max_bpm} BPM')
+  scores = smoothed[lags]
+  if prior_bpm is not None:
+    scores = scores * np.exp(-0.5 * np.log2(60 * feature_rate / lags / prior_bpm) ** 2)
+  # Only local maxima are candidates for the beat period
+  peaks = (smoothed[lags] >= smoothed[lags - 1]) & (smoothed[lags] >= smoothed[lags + 1])
+  if not peaks.any():
+    peaks[:] = True
+  strong = peaks & (scores >= STRONG_PEAK_RATIO * scores[peaks].max())
+  lag = lags[np.argmax(strong)]
+  # Interpolate around the highest of the unsmoothed lags next to the chosen one
+  lag = min(max(lag - 1 + int(np.argmax(autocorrelation[lag - 1:lag + 2])), 1), n - 2)
+  before, peak, after = autocorrelation[lag - 1:lag + 2]
+  curvature = before - 2 * peak + after
+  shift = 0.5 * (before - after) / curvature if curvature < 0 else 0
+  return 60 * feature_rate / (lag + shift)
 
-samplerate = 22050
-penalty_factor = 0.5
+# Returns the beat times in seconds found in a novelty function for a tempo estimate (in BPM) and penalty factor
+def beats_from_novelty(novelty_function, feature_rate, tempo_est, penalty_factor=0.5):
+  beat_sequence_samples = libfmp.c6.compute_beat_sequence(novelty_function, convert_tempo(tempo_est), factor=penalty_factor)
+  sample_times = np.arange(novelty_function.shape[0]) / feature_rate
+  return sample_times[beat_sequence_samples]
 
-audio_series, _ = librosa.load(str(audio_path), samplerate)
+# Returns a dictionary mapping each (tempo estimate, penalty factor) combination to the beat times of an audio file
+# If tempo_estimates is empty, a single estimate is inferred with estimate_tempo between min_bpm and max_bpm (optionally favouring prior_bpm)
+# The novelty function is only computed (or read from the cache) once for all combinations
+def track(audio_path, tempo_estimates=(), penalty_factors=(0.5,), min_bpm=60, max_bpm=240, prior_bpm=None):
+  novelty_function, feature_rate = novelty(audio_path)
+  if not tempo_estimates:
+    tempo_estimates = [estimate_tempo(novelty_function, feature_rate, min_bpm, max_bpm, prior_bpm)]
+  return {(tempo_est, penalty_factor): beats_from_novelty(novelty_function, feature_rate, tempo_est, penalty_factor)
+          for tempo_est, penalty_factor in product(tempo_estimates, penalty_factors)}
 
-novelty_function, feature_rate = libfmp.c6.compute_novelty_spectrum(audio_series, Fs=samplerate, N=2048, H=512, gamma=100, M=10, norm=True)
-novelty_function, feature_rate = libfmp.c6.resample_signal(novelty_function, Fs_in=feature_rate, Fs_out=100)
+# Tracks the beats of every audio file in audio_paths across a pool of processes (all cores if processes is None)
+# Returns a dictionary mapping each path to the result of track for that file
+def track_all(audio_paths, tempo_estimates=(), penalty_factors=(0.5,), min_bpm=60, max_bpm=240, prior_bpm=None, processes=None):
+  audio_paths = list(audio_paths)
+  n = len(audio_paths)
+  if n > 1 and processes != 1:
+    with ProcessPoolExecutor(processes) as executor:
+      results = list(executor.map(track, audio_paths, [tempo_estimates] * n, [penalty_factors] * n, [min_bpm] * n, [max_bpm] * n, [prior_bpm] * n))
+  else:
+    results = [track(audio_path, tempo_estimates, penalty_factors, min_bpm, max_bpm, prior_bpm) for audio_path in audio_paths]
+  return dict(zip(audio_paths, results))
 
-beat_sequence_samples = libfmp.c6.compute_beat_sequence(novelty_function, convert_tempo(tempo_est), factor=penalty_factor)
-sample_times = np.arange(novelty_function.shape[0]) / feature_rate
+# Returns the audio files to track for a path, which can be a single file or a directory
+def audio_files(path):
+  path = Path(path)
+  if path.is_dir():
+    return sorted(file for file in path.iterdir() if file.suffix.lower() in AUDIO_EXTENSIONS)
+  return [path]
 
-beats_sequence_seconds = sample_times[beat_sequence_samples]
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Estimate the locations of beats in audio recordings')
+  parser.add_argument('audio_path', help='Audio file, or directory of audio files')
+  parser.add_argument('tempo_estimates', type=float, nargs='*', help='Tempo estimates in BPM (default: inferred for each file)')
+  parser.add_argument('--penalty', type=float, nargs='+', default=[0.5], help='Penalty factors for deviating from the tempo estimate')
+  parser.add_argument('--min-bpm', type=float, default=60, help='Lowest tempo to consider when inferring a tempo estimate')
+  parser.add_argument('--max-bpm', type=float, default=240, help='Highest tempo to consider when inferring a tempo estimate')
+  parser.add_argument('--prior-bpm', type=float, help='Tempo to favour when inferring a tempo estimate (default: none, choosing the fastest strong periodicity)')
+  parser.add_argument('--processes', type=int, help='Number of worker processes (default: all cores)')
+  parser.add_argument('--corpus', action='store_true', help='Add the beats to data/waltz-auto.corpus instead of saving text files')
+  args = parser.parse_args()
 
-output_path = Path() / 'data' / 'waltz-auto' / (title + '.txt')
-np.savetxt(output_path, beats_sequence_seconds)
-print('Saved to', str(output_path.resolve()))
+  results = track_all(audio_files(args.audio_path), args.tempo_estimates, args.penalty, args.min_bpm, args.max_bpm, args.prior_bpm, args.processes)
+  sweep = len(args.tempo_estimates) > 1 or len(args.penalty) > 1
+  # With --corpus, every result is added to the corpus in a single rewrite once all files are tracked
+  frames = {}
+  metadata = {}
+  for audio_path, beats in results.items():
+    for (tempo_est, penalty_factor), beats_sequence_seconds in beats.items():
+      title = f'{audio_path.stem}-t{tempo_est:g}-p{penalty_factor:g}' if sweep else audio_path.stem
+      if args.corpus:
+        frames[title] = pd.DataFrame({'Onset': beats_sequence_seconds})
+        metadata[title] = {'tempo_estimate': tempo_est, 'penalty_factor': penalty_factor}
+        print(f'Tracked {title} (tempo estimate {tempo_est:g} BPM)')
+      else:
+        output_path = Path() / 'data' / 'waltz-auto' / (title + '.txt')
+        np.savetxt(output_path, beats_sequence_seconds, header=f'tempo_estimate: {tempo_est:g}')
+        print(f'Saved to {output_path.resolve()} (tempo estimate {tempo_est:g} BPM)')
+  if args.corpus:
+    output_path = Path() / 'data' / 'waltz-auto.corpus'
+    corpus.append_all(output_path, frames, metadata)
+    print(f'Saved {len(frames)} recordings to {output_path.resolve()}')
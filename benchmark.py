@@ -0,0 +1,212 @@
+# Benchmarks the main stages of the analysis on a synthetic corpus
+# Usage: python benchmark.py [--takes N] [--cycles N] [--instruments N] [--beat-divisions 3,3,3,3] [--repeats N] [--output benchmark-results.jsonl]
+# Each stage is timed (best of --repeats runs) and its peak memory is measured in a separate traced run
+# Stages which can use a pool of processes are run with processes=1, as tracemalloc only sees memory allocated in this process
+# Results are appended to the output file along with the current git commit, and compared with the last results for a different commit
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+from music21 import chord, meter, metadata, note, stream
+
+import density
+import mixture
+from convert_musicxml import MXLConverter
+from piece import Piece
+
+PROCESSED_COLUMNS = ('Onset_time', 'Cycle_number', 'Metric_location', 'Metric_location_index', 'Is_included_in_grid', 'Phase')
+
+
+# Writes a synthetic processed corpus to data/<name>/, in the same format as the suku data
+# Every instrument plays on each beat with probability 1 (so any of them can be the beat instrument for tempo analysis) and on other pulse units with probability hit_probability
+def generate_processed(name, takes, cycles, instruments, beat_divisions, hit_probability=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    beat_division = beat_divisions[0]
+    pulse_units = sum(beat_divisions)
+    path = Path('data') / name
+    path.mkdir(parents=True, exist_ok=True)
+    pulse = np.arange(pulse_units)
+    beat = pulse // beat_division
+    sub = pulse % beat_division
+    for take in range(1, takes + 1):
+        # Tempo accelerates through the take, as in the jembe recordings
+        pulse_duration = np.linspace(0.15, 0.1, cycles * pulse_units)
+        grid = np.concatenate([[0], np.cumsum(pulse_duration)[:-1]])
+        for instrument in range(1, instruments + 1):
+            played = (rng.random(cycles * pulse_units) < hit_probability) | np.tile(sub == 0, cycles)
+            jitter = rng.normal(0, 0.03, cycles * pulse_units) + np.tile(np.where(sub == 0, 0, -0.1), cycles)
+            loc_index = np.tile(pulse + 1, cycles)
+            df = pd.DataFrame({
+                'Onset_time': grid + jitter * pulse_duration,
+                'Cycle_number': np.repeat(np.arange(1, cycles + 1), pulse_units),
+                'Metric_location': np.tile(beat + np.floor(10 * sub / beat_division) / 10, cycles),
+                'Metric_location_index': loc_index,
+                'Phase': (loc_index - 1 + jitter) / beat_division,
+                'Is_included_in_grid': 1,
+            })[played]
+            df.to_csv(path / f'take.{take}_Instrument-{instrument}.csv', index=False)
+
+
+# Writes a synthetic corpus of beat onsets to data/<name>/, in the same format as the waltz data
+def generate_onsets(name, takes, cycles, beats, seed=0):
+    rng = np.random.default_rng(seed)
+    path = Path('data') / name
+    path.mkdir(parents=True, exist_ok=True)
+    for take in range(1, takes + 1):
+        beat_duration = rng.normal(0.5, 0.03, cycles * beats)
+        pd.DataFrame({'Onset': np.cumsum(beat_duration)}).to_csv(path / f'take-{take}.csv', index=False)
+
+
+# Builds a synthetic music21 score with the given number of parts and 3/4 measures of notes, rests and chords
+def generate_score(parts, measures, seed=0):
+    rng = np.random.default_rng(seed)
+    rhythms = [[1, 1, 1], [0.5, 0.5, 1, 1], [2, 1], [0.25, 0.25, 0.5, 2]]
+    score = stream.Score()
+    score.metadata = metadata.Metadata(title='Benchmark')
+    for _ in range(parts):
+        part = stream.Part()
+        for i in range(measures):
+            measure = stream.Measure(number=i + 1)
+            if i == 0:
+                measure.timeSignature = meter.TimeSignature('3/4')
+            for quarter_length in rhythms[rng.integers(len(rhythms))]:
+                kind = rng.random()
+                if kind < 0.1:
+                    element = note.Rest(quarterLength=quarter_length)
+                elif kind < 0.2:
+                    element = chord.Chord([60, 64, 67], quarterLength=quarter_length)
+                else:
+                    element = note.Note(int(rng.integers(48, 72)), quarterLength=quarter_length)
+                measure.append(element)
+            part.append(measure)
+        score.insert(0, part)
+    return score
+
+
+# Times stage (a function of no arguments), returning the best time in seconds over repeats runs and the peak memory in bytes of one further traced run
+def measure(stage, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+# Returns the stages to benchmark, as a dictionary mapping each stage name to a function of no arguments
+def stages(args):
+    beat_divisions = args.beat_divisions
+    beats = len(beat_divisions)
+
+    def load_processed(use_cache):
+        piece = Piece('synthetic', beat_divisions, use_cache=use_cache)
+        piece.load_processed(*PROCESSED_COLUMNS)
+        return piece
+
+    processed = load_processed(True)
+    onsets = Piece('synthetic-onsets', [2] * beats, [1], use_cache=False)
+    onsets.load_from_onsets('Onset')
+    score = generate_score(args.instruments, args.cycles)
+
+    def mle(piece):
+        mixture._models.clear()
+        piece._mixtures.clear()
+        piece.fit_mixtures(processes=1)
+        piece.mle()
+
+    return {
+        '_load_joined': lambda: Piece('synthetic', beat_divisions)._load_joined(),
+        'load_processed (cold)': lambda: load_processed(False),
+        'load_processed (cache)': lambda: load_processed(True),
+        'load_from_onsets': lambda: Piece('synthetic-onsets', [2] * beats, use_cache=False).load_from_onsets('Onset'),
+        'mle': lambda: mle(processed),
+        'mle (mixture)': lambda: mle(onsets),
+        'tempo': lambda: processed.tempo_fits('Instrument-1', 95, processes=1),
+        'rhythm_sequence': lambda: processed.rhythm_sequence('Instrument-1', 1000),
+        'kde': lambda: density.estimate([group['Offset'] for _, group in processed.df.groupby(processed.metric_loc)]),
+        'convert_score': lambda: MXLConverter().convert_score(score),
+    }
+
+
+# Returns the current git commit, or None if it cannot be found
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Returns the most recent stored result for each stage with the same parameters but a different commit
+def previous_results(output, params, commit):
+    previous = {}
+    if output.exists():
+        with open(output) as file:
+            for line in file:
+                result = json.loads(line)
+                if result['params'] == params and result['commit'] != commit:
+                    previous[result['stage']] = result
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analysis stages on a synthetic corpus')
+    parser.add_argument('--takes', type=int, default=10)
+    parser.add_argument('--cycles', type=int, default=100)
+    parser.add_argument('--instruments', type=int, default=3)
+    parser.add_argument('--beat-divisions', type=lambda s: [int(i) for i in s.split(',')], default=[3, 3, 3, 3])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', type=Path, default=Path('benchmark-results.jsonl'))
+    args = parser.parse_args()
+
+    params = {'takes': args.takes, 'cycles': args.cycles, 'instruments': args.instruments, 'beat_divisions': args.beat_divisions}
+    commit = git_commit()
+    output = args.output.resolve()
+    previous = previous_results(output, params, commit)
+    warnings.simplefilter('ignore')
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Pieces load from data/ and cache to cache/ relative to the working directory
+        os.chdir(directory)
+        try:
+            generate_processed('synthetic', args.takes, args.cycles, args.instruments, args.beat_divisions)
+            generate_onsets('synthetic-onsets', args.takes, args.cycles, len(args.beat_divisions))
+            for stage, function in stages(args).items():
+                seconds, peak = measure(function, args.repeats)
+                results.append({'commit': commit, 'time': time.time(), 'params': params, 'stage': stage, 'seconds': seconds, 'peak_memory': peak})
+        finally:
+            os.chdir(cwd)
+
+    with open(output, 'a') as file:
+        for result in results:
+            file.write(json.dumps(result) + '\n')
+
+    print(f'{"Stage":<24}{"Time (ms)":>12}{"Peak memory (MB)":>18}{"Previous (ms)":>15}{"Change":>9}')
+    for result in results:
+        line = f'{result["stage"]:<24}{result["seconds"] * 1000:>12.1f}{result["peak_memory"] / 2**20:>18.2f}'
+        if result['stage'] in previous:
+            before = previous[result['stage']]['seconds']
+            line += f'{before * 1000:>15.1f}{(result["seconds"] / before - 1) * 100:>+8.0f}%'
+        print(line)
+    print('Saved to', output)
+
+
+if __name__ == "__main__":
+    main()
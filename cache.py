@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Persistent on-disk cache of loaded dataframes, stored as Parquet files in cache/
+# Each entry is keyed by a fingerprint of the source files and the arguments used to load them,
+# so it is invalidated automatically whenever a file is modified or the column mapping changes
+CACHE_DIR = Path('cache')
+
+# Increment whenever the format of the cached dataframes changes, to invalidate existing entries
+VERSION = 3
+
+
+# Returns a hex digest which changes whenever any of the files at paths (by name, size, or modification time) or any keyword argument changes
+# If content is True, the contents of each file are hashed too, for filesystems where modification times are unreliable
+def fingerprint(paths, content=False, **kwargs):
+    digest = hashlib.sha256(f'{VERSION}\n'.encode())
+    for path in sorted(Path(p) for p in paths):
+        stat = path.stat()
+        digest.update(f'{path.as_posix()}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+        if content:
+            digest.update(hashlib.sha256(path.read_bytes()).digest())
+    digest.update(json.dumps(kwargs, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _entry_path(name, key):
+    return CACHE_DIR / f'{name}-{key[:16]}.parquet'
+
+
+# Private function which returns the paths of every cache entry for name, matching the exact format of _entry_path
+# so that the entries of a piece whose name starts with name (e.g. waltz-auto for waltz) are not included
+def _entries(name):
+    pattern = re.compile(re.escape(name) + r'-[0-9a-f]{16}\.parquet')
+    return [path for path in CACHE_DIR.glob('*.parquet') if pattern.fullmatch(path.name)]
+
+
+# Yields a temporary path in the same directory as path to write a file to, which is moved onto path once the with block finishes
+# Analyses running in other processes may be reading the cache at the same time, so a file in it must never be seen half-written
+# If the block raises an exception, the temporary file is deleted and path is left as it was
+@contextmanager
+def atomic_path(path):
+    # The process ID keeps the temporary files of concurrent writers apart
+    temporary_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+
+
+# Returns True if the cache can be used, i.e. a Parquet engine is installed
+def available():
+    return pyarrow is not None
+
+
+# Returns the cached dataframe stored under name and key, or None if there is no valid entry
+# The file is memory-mapped rather than read into a buffer first
+def load(name, key):
+    path = _entry_path(name, key)
+    if not available() or not path.exists():
+        return None
+    try:
+        return pd.read_parquet(path, memory_map=True)
+    except FileNotFoundError:
+        # Deleted as stale by another process since it was found
+        return None
+
+
+# Stores df in the cache under name and key, then deletes any stale entries for the same name
+# Other processes may be storing or deleting entries for the same name at the same time, so entries which have already gone are skipped
+def save(name, key, df):
+    if not available():
+        return
+    CACHE_DIR.mkdir(exist_ok=True)
+    path = _entry_path(name, key)
+    with atomic_path(path) as temporary_path:
+        df.to_parquet(temporary_path)
+    for stale in _entries(name):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+
+
+# Deletes all cache entries, or only those for the given name
+def clear(name=None):
+    for path in (_entries(name) if name else CACHE_DIR.glob('*.parquet')):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,60 @@
+import re
+
+import pandas as pd
+
+
+# Catalog of the takes and instruments in a piece, parsed once from the names of its files
+# File names come in two styles: processed-data_E1-ALL.take.<take>.line.<line>.rec.<recording>_<instrument> (e.g. suku, where line and recording are optional)
+# and <prefix><take><instrument> (e.g. SavedCandombetableMaraka3Jembe1). Any other name (e.g. blue-danube_manual) is a take of its own with no instrument
+# Instrument names are compared without case or hyphens, so Jembe-1, Jembe1 and jembe1 are all Jembe1
+_TAKE_LINE_RECORDING = re.compile(r'take\.(?P<Take>\d+)(\.line\.(?P<Line>[^.]+))?(\.rec\.(?P<Recording>\d+))?_(?P<Instrument>[A-Za-z]+-?\d+)$')
+_TAKE_INSTRUMENT = re.compile(r'[A-Za-z](?P<Take>\d+)_?(?P<Instrument>[A-Za-z]+-?\d+)$')
+
+COLUMNS = ['Take', 'Instrument', 'Line', 'Recording']
+
+
+# Returns the canonical form of an instrument name, e.g. Jembe1 for jembe1 or Jembe-1
+def instrument_name(instrument):
+    return instrument.replace('-', '').capitalize()
+
+
+# Returns a dictionary of the take, instrument, line and recording parsed from a file name (without its extension)
+# Takes and recordings are integers where the name contains them, and missing values are None
+def parse_filename(name):
+    metadata = dict.fromkeys(COLUMNS)
+    match = _TAKE_LINE_RECORDING.search(name) or _TAKE_INSTRUMENT.search(name)
+    if match is None:
+        metadata['Take'] = name
+        metadata['Instrument'] = ''
+        return metadata
+    metadata.update(match.groupdict())
+    metadata['Take'] = int(metadata['Take'])
+    metadata['Instrument'] = instrument_name(metadata['Instrument'])
+    if metadata['Recording'] is not None:
+        metadata['Recording'] = int(metadata['Recording'])
+    return metadata
+
+
+# Returns a dataframe of the metadata of each file name in names (see parse_filename), indexed by file name
+def parse_filenames(names):
+    return pd.DataFrame([parse_filename(name) for name in names], index=pd.Index(names, name='File'), columns=COLUMNS)
+
+
+# Returns a catalog like that of parse_filenames for count files with no names of their own (e.g. dataframes passed to Piece.load_from_onsets),
+# which are named take-1, take-2, ... and numbered as takes in order, with no instrument
+def numbered_takes(count):
+    names = [f'take-{take}' for take in range(1, count + 1)]
+    return pd.DataFrame({'Take': range(1, count + 1), 'Instrument': ''}, index=pd.Index(names, name='File'), columns=COLUMNS)
+
+
+# Returns df (which has a File column) indexed by take, instrument, cycle number and metric location, sorted so that any slice of the index
+# (e.g. all cycles of one instrument in one take) is found by binary search. files is a dataframe returned by parse_filenames
+def build_index(df, files, cycle_num, metric_loc):
+    file_names = df['File'].astype(str)
+    indexed = df.set_index([
+        pd.Index(files['Take'].reindex(file_names).to_numpy(), name='Take'),
+        pd.Index(files['Instrument'].reindex(file_names).to_numpy(), name='Instrument'),
+        cycle_num,
+        metric_loc,
+    ], drop=False)
+    return indexed.sort_index(kind='stable')
@@ -1,31 +1,74 @@
+import hashlib
 import math
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from fractions import Fraction
 from pathlib import Path
 
-from music21 import chord, converter, meter, note
+import music21
+from music21 import chord, converter, freezeThaw, meter, note
+
+MUSICXML_EXTENSIONS = ['.mxl', '.musicxml', '.xml']
+
+# Parsed scores are cached here in music21's pickled form, keyed by a hash of the file's contents and the music21 version
+PARSE_CACHE_DIR = Path('cache') / 'musicxml'
 
 
 class MXLConverter:
 
-    def load_xml(self, path):
-        return converter.parse(path)
+    def __init__(self):
+        # Converted durations are memoized by (metre, offset, quarterLength), where metre is the converted beat sequence of the current time signature
+        self._durations = {}
+        self.time_signature = None
+        self.metre = None
+
+    # Parses a MusicXML file, reading it from the parse cache if use_cache is True and the same file has been parsed before
+    def load_xml(self, path, use_cache=True):
+        if not use_cache:
+            return converter.parse(path)
+        digest = hashlib.sha256(Path(path).read_bytes())
+        digest.update(music21.__version__.encode())
+        cache_path = PARSE_CACHE_DIR / (digest.hexdigest()[:32] + '.p')
+        if not cache_path.exists():
+            PARSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # As in music21's own pickling, the unsafe freezer changes the score, so a thawed copy is returned instead
+            # (music21 treats relative paths as relative to its scratch directory, so the path is made absolute)
+            # Other processes converting the same file may read the cache at the same time, so it is written atomically
+            freezer = freezeThaw.StreamFreezer(converter.parse(path, forceSource=True, storePickle=False), fastButUnsafe=True)
+            with _atomic_path(cache_path.resolve()) as temporary_path:
+                freezer.write(fp=temporary_path, zipType='zlib')
+        thawer = freezeThaw.StreamThawer()
+        thawer.open(cache_path.resolve(), zipType='zlib')
+        return thawer.stream
+
+    # Sets the time signature used to convert durations
+    def set_time_signature(self, time_signature):
+        self.time_signature = time_signature
+        self.metre = self.parse_meter_sequence(time_signature.beatSequence)
 
     def convert_duration(self, note):
+        key = (self.metre, note.offset, note.quarterLength)
+        if key not in self._durations:
+            self._durations[key] = self._convert_duration(note.offset, note.quarterLength)
+        return self._durations[key]
+
+    def _convert_duration(self, offset, quarter_length):
         beat_sequence = self.time_signature.beatSequence
-        indices = beat_sequence.offsetToAddress(note.offset)
+        indices = beat_sequence.offsetToAddress(offset)
         level = duration = None
         for i in range(len(indices)):
             # Try to find a level which the note's duration can be divided into
             subsequence = beat_sequence[indices[i]]
-            if note.quarterLength % subsequence.duration.quarterLength == 0:
+            if quarter_length % subsequence.duration.quarterLength == 0:
                 level = i
-                duration = int(note.quarterLength / subsequence.duration.quarterLength)
+                duration = int(quarter_length / subsequence.duration.quarterLength)
                 break
             beat_sequence = subsequence
         if level is None:
             # Need to go deeper
-            note_fraction = Fraction(note.quarterLength) / 4
+            note_fraction = Fraction(quarter_length) / 4
             deepest_level = Fraction(beat_sequence.numerator, beat_sequence.denominator)
             level_difference = math.log(note_fraction.denominator / deepest_level.denominator, 2)
             level = int(len(indices) + level_difference - 1)
@@ -52,19 +95,26 @@ class MXLConverter:
     def convert_tempo(self, tempo):
         return f'use_bpm {tempo.getQuarterBPM()}\n'
 
-    def convert_measure(self, measure):
-        output = 'bar do\n'
+    # The write_* methods pass the converted output in pieces to write, a function taking a string (e.g. list.append or file.write),
+    # so that it is never concatenated, and the convert_* methods return it as one string
+
+    def write_measure(self, measure, write):
+        write('bar do\n')
         for element in measure.getElementsByClass(['Note', 'Rest', 'Chord', 'MetronomeMark']):
             if isinstance(element, note.Note):
-                output += self.convert_note(element)
+                write(self.convert_note(element))
             elif isinstance(element, note.Rest):
-                output += self.convert_rest(element)
+                write(self.convert_rest(element))
             elif isinstance(element, chord.Chord):
-                output += self.convert_chord(element)
+                write(self.convert_chord(element))
             else:
-                output += self.convert_tempo(element)
-        output += 'end\n'
-        return output
+                write(self.convert_tempo(element))
+        write('end\n')
+
+    def convert_measure(self, measure):
+        output = []
+        self.write_measure(measure, output.append)
+        return ''.join(output)
 
     def parse_meter_sequence(self, sequence):
         if isinstance(sequence, meter.MeterSequence):
@@ -77,30 +127,133 @@ class MXLConverter:
     def convert_metre(self, beat_sequence):
         return f'use_metre {self.parse_meter_sequence(beat_sequence)}\n'
 
-    def convert_part(self, part):
-        output = 'in_thread do\n'
+    def write_part(self, part, write):
+        write('in_thread do\n')
         for measure in part['Measure']:
             if measure.timeSignature is not None:
-                self.time_signature = measure.timeSignature
-                output += self.convert_metre(measure.timeSignature.beatSequence)
-            output += self.convert_measure(measure)
-        output += 'end\n'
-        return output
+                self.set_time_signature(measure.timeSignature)
+                write(self.convert_metre(measure.timeSignature.beatSequence))
+            self.write_measure(measure, write)
+        write('end\n')
+
+    def convert_part(self, part):
+        output = []
+        self.write_part(part, output.append)
+        return ''.join(output)
 
-    def convert_score(self, score):
-        output = f'$title = "{score.metadata.title}"\n'
-        for part in score.parts:
-            output += self.convert_part(part)
-        return output
+    # Parts are converted in order, or in parallel worker processes if processes is not 1 (all cores if None)
+    # Each part is then sent to a worker, which is only faster for large scores since parts are slow to pickle
+    def write_score(self, score, write, processes=1):
+        write(f'$title = "{score.metadata.title}"\n')
+        parts = list(score.parts)
+        if processes == 1 or len(parts) < 2:
+            for part in parts:
+                self.write_part(part, write)
+            return
 
+        # A part without its own time signature continues with the last one of the part before it
+        time_signatures = []
+        time_signature = self.time_signature
+        for part in parts:
+            time_signatures.append(time_signature)
+            for measure in part['Measure']:
+                if measure.timeSignature is not None:
+                    time_signature = measure.timeSignature
+        with ProcessPoolExecutor(processes) as executor:
+            for output in executor.map(_convert_part, parts, time_signatures):
+                write(output)
+        if time_signature is not None:
+            self.set_time_signature(time_signature)
 
+    def convert_score(self, score, processes=1):
+        output = []
+        self.write_score(score, output.append, processes)
+        return ''.join(output)
+
+
+# Private function which converts a part in a worker process, starting with the given time signature
+def _convert_part(part, time_signature):
+    mxlconverter = MXLConverter()
+    if time_signature is not None:
+        mxlconverter.set_time_signature(time_signature)
+    return mxlconverter.convert_part(part)
+
+
+# Yields a temporary path in the same directory as path to write a file to, which is moved onto path once the with block finishes
+# If the block raises an exception, the temporary file is deleted and path is left as it was, so a failed conversion never leaves a truncated file
+@contextmanager
+def _atomic_path(path):
+    # The process ID keeps the temporary files of concurrent conversions apart
+    temporary_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+
+
+# Opens a temporary file for writing which replaces output_path once the with block finishes (see _atomic_path)
+@contextmanager
+def _atomic_output(output_path):
+    with _atomic_path(output_path) as temporary_path, open(temporary_path, 'w') as file:
+        yield file
+
+
+# Converts a MusicXML file to a .rb file next to it, unless the .rb file is newer than the MusicXML file and force is False
+# Returns the path of the .rb file if it was converted, otherwise None
+def convert_file(path, force=False, use_cache=True):
+    path = Path(path)
+    output_path = path.parent / (path.stem + '.rb')
+    if not force and output_path.exists() and output_path.stat().st_mtime >= path.stat().st_mtime:
+        return None
+    mxlconverter = MXLConverter()
+    score = mxlconverter.load_xml(path, use_cache)
+    with _atomic_output(output_path) as file:
+        mxlconverter.write_score(score, file.write)
+    return output_path
+
+
+# Converts every MusicXML file in a directory with convert_file, across a pool of processes (all cores if processes is None)
+# Returns a list of the paths of the .rb files which were converted
+def convert_directory(directory, force=False, use_cache=True, processes=None):
+    paths = sorted(path for path in Path(directory).iterdir() if path.suffix.lower() in MUSICXML_EXTENSIONS)
+    if len(paths) > 1 and processes != 1:
+        with ProcessPoolExecutor(processes) as executor:
+            output_paths = list(executor.map(convert_file, paths, [force] * len(paths), [use_cache] * len(paths)))
+    else:
+        output_paths = [convert_file(path, force, use_cache) for path in paths]
+    return [output_path for output_path in output_paths if output_path is not None]
+
+
+# Usage: python convert_musicxml.py <path_to_musicxml> [--no-save] [--quiet] [--no-cache] [--processes <n>]
+# The converted score is streamed to a temporary file which replaces the .rb file next to the input once it is complete (unless --no-save),
+# and printed (unless --quiet)
+# If the path is a directory, every MusicXML file in it is converted concurrently without printing, skipping those whose .rb file
+# is newer unless --force is given
 if __name__ == "__main__":
     path = Path(sys.argv[1])
+    processes = int(sys.argv[sys.argv.index('--processes') + 1]) if '--processes' in sys.argv else None
+    use_cache = '--no-cache' not in sys.argv
+    if path.is_dir():
+        output_paths = convert_directory(path, '--force' in sys.argv, use_cache, processes)
+        for output_path in output_paths:
+            print(f"Saved to {output_path}")
+        print(f"Converted {len(output_paths)} files")
+        sys.exit()
+
     mxlconverter = MXLConverter()
-    score = mxlconverter.load_xml(path)
-    converted = mxlconverter.convert_score(score)
-    print(converted)
+    score = mxlconverter.load_xml(path, use_cache)
+    output_path = path.parent / (path.stem + '.rb')
+    with nullcontext() if '--no-save' in sys.argv else _atomic_output(output_path) as file:
+        writers = ([] if '--quiet' in sys.argv else [sys.stdout.write]) + ([file.write] if file else [])
+
+        def write(output):
+            for writer in writers:
+                writer(output)
+
+        mxlconverter.write_score(score, write, processes or 1)
+    if '--quiet' not in sys.argv:
+        print()
     if '--no-save' not in sys.argv:
-        with open(path.parent / (path.stem + '.rb'), 'w') as file:
-            file.write(converted)
-        print(f"Saved to {path.parent / (path.stem + '.rb')}")
+        print(f"Saved to {output_path}")
@@ -0,0 +1,180 @@
+# Converts the .csv files of a piece into a single binary corpus file, data/<name>.corpus
+# Usage: python corpus.py <piece_name>
+
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import loader
+
+# Binary corpus format: a single file per piece holding every file (take and instrument) of its data
+# The file starts with MAGIC, then the length of a JSON header as a little-endian uint64, then the header itself
+# The header lists each file's name, metadata, first row and number of rows, and each column's name, dtype and byte offset
+# Each column is stored as one contiguous array of all files' rows (in file order) at its offset, aligned to ALIGNMENT bytes,
+# so a column of any file or run of consecutive files can be sliced from a memory map without copying
+MAGIC = b'MTCORPUS'
+ALIGNMENT = 64
+
+# Increment whenever the format of the header or data changes, so that corpora written in an older format are ignored until they are converted again
+# This is independent of cache.VERSION, as a corpus does not depend on the format of the Parquet cache
+VERSION = 2
+
+
+# Private function which returns the number of bytes needed to pad size to a multiple of ALIGNMENT
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+# Writes a corpus file to path from frames, a dictionary mapping each file name to its dataframe
+# metadata is an optional dictionary mapping file names to dictionaries of extra information (e.g. take and instrument) to store in the header
+# source is an optional fingerprint (see fingerprint) of the files the corpus was converted from, used to detect when it is out of date (see matches)
+# Columns missing from some files are filled with NaN; non-numeric columns are not stored
+def write(path, frames, metadata=None, source=None):
+    metadata = metadata or {}
+    names = list(frames)
+    columns = []
+    for df in frames.values():
+        columns += [column for column in df.columns if column not in columns and pd.api.types.is_numeric_dtype(df[column])]
+
+    files = []
+    start = 0
+    for name in names:
+        files.append({'name': name, 'metadata': metadata.get(name, {}), 'start': start, 'rows': len(frames[name])})
+        start += len(frames[name])
+
+    arrays = []
+    for column in columns:
+        parts = [frames[name][column].to_numpy() if column in frames[name] else np.full(len(frames[name]), np.nan) for name in names]
+        arrays.append(np.concatenate(parts) if parts else np.empty(0))
+
+    # Offsets are relative to the start of the data section, which follows the header
+    offset = 0
+    header_columns = []
+    for column, array in zip(columns, arrays):
+        header_columns.append({'name': column, 'dtype': array.dtype.str, 'offset': offset})
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({'version': VERSION, 'files': files, 'columns': header_columns, 'rows': start, 'source': source}).encode()
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(np.uint64(len(header)).tobytes())
+        file.write(header)
+        file.write(b'\0' * _padding(len(MAGIC) + 8 + len(header)))
+        for array in arrays:
+            file.write(array.tobytes())
+            file.write(b'\0' * _padding(array.nbytes))
+
+
+# Returns the fingerprint of the .csv files a corpus is converted from: a dictionary mapping each file name to its size, modification time and a hash of its contents
+def fingerprint(paths):
+    source = {}
+    for path in map(Path, paths):
+        stat = path.stat()
+        source[path.name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hashlib.sha256(path.read_bytes()).hexdigest()}
+    return source
+
+
+# Returns True if the .csv files at paths are the same files, with the same contents, as when source (see fingerprint) was taken
+# Each file is compared by size and modification time first, and its contents are only hashed if its modification time has changed (e.g. in a fresh checkout),
+# so checking an unchanged corpus does not read the files it replaces
+def matches(source, paths):
+    paths = [Path(path) for path in paths]
+    if sorted(path.name for path in paths) != sorted(source):
+        return False
+    for path in paths:
+        stat = path.stat()
+        expected = source[path.name]
+        if stat.st_size != expected['size']:
+            return False
+        if stat.st_mtime_ns != expected['mtime_ns'] and hashlib.sha256(path.read_bytes()).hexdigest() != expected['sha256']:
+            return False
+    return True
+
+
+# Adds (or replaces) files in the corpus at path, creating it if it does not exist
+# frames is a dictionary mapping each file name to its dataframe, and metadata optionally maps file names to their metadata (see write)
+# The source of an existing corpus is kept, and a new corpus has none, as it is not converted from any .csv files
+# The whole corpus is read and rewritten once, so files should be added together rather than one at a time where possible
+def append_all(path, frames, metadata=None):
+    metadata = metadata or {}
+    all_frames = {}
+    all_metadata = {}
+    source = None
+    if Path(path).exists():
+        corpus = Corpus(path)
+        all_frames = {file: corpus.frame([file]).copy() for file in corpus.names}
+        all_metadata = {file['name']: file['metadata'] for file in corpus.files}
+        source = corpus.source
+    for name, df in frames.items():
+        all_frames[name] = df
+        all_metadata[name] = metadata.get(name, {})
+    write(path, all_frames, all_metadata, source)
+
+
+# Adds (or replaces) a single file in the corpus at path (see append_all)
+def append(path, name, df, metadata=None):
+    append_all(path, {name: df}, {name: metadata or {}})
+
+
+# A corpus file opened for reading, with every column memory-mapped
+class Corpus:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a corpus file')
+            header_length = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+            header = json.loads(file.read(header_length))
+        data_offset = len(MAGIC) + 8 + header_length + _padding(len(MAGIC) + 8 + header_length)
+        # Corpora written before the format was versioned have no version
+        self.version = header.get('version', 1)
+        self.files = header['files']
+        self.names = [file['name'] for file in self.files]
+        self.source = header['source']
+        self._files = {file['name']: file for file in self.files}
+        self._columns = {}
+        for column in header['columns']:
+            dtype = np.dtype(column['dtype'])
+            if header['rows'] == 0:
+                self._columns[column['name']] = np.empty(0, dtype)
+            else:
+                self._columns[column['name']] = np.memmap(self.path, dtype, mode='r', offset=data_offset + column['offset'], shape=(header['rows'],))
+
+    # Returns the names of the stored columns
+    def columns(self):
+        return list(self._columns)
+
+    # Returns a dataframe of the rows of the given files (default all files), restricted to a list of columns (any which are None are ignored)
+    # Each file's rows are indexed from 0, as if its .csv file had been read. If the files are consecutive in the corpus, the columns are not copied
+    def frame(self, names=None, columns=None):
+        names = self.names if names is None else names
+        columns = self.columns() if columns is None else [column for column in columns if column is not None]
+        files = [self._files[name] for name in names]
+        starts = [file['start'] for file in files]
+        rows = [file['rows'] for file in files]
+        consecutive = all(starts[i] + rows[i] == starts[i + 1] for i in range(len(files) - 1))
+        if consecutive and files:
+            data = {column: self._columns[column][starts[0]:starts[-1] + rows[-1]] for column in columns}
+        else:
+            data = {column: np.concatenate([self._columns[column][start:start + n] for start, n in zip(starts, rows)] or [np.empty(0)]) for column in columns}
+        index = np.concatenate([np.arange(n) for n in rows]) if len(files) != 1 else pd.RangeIndex(rows[0])
+        return pd.DataFrame(data, index=index, copy=False)
+
+
+# Converts the .csv files in data/<name>/ into a corpus file at data/<name>.corpus, returning its path
+def convert(name):
+    paths = list(Path().glob(f'data/{name}/*.csv'))
+    frames = {path.stem: loader.downcast(loader.read_csv(path)) for path in paths}
+    output_path = Path('data') / f'{name}.corpus'
+    write(output_path, frames, source=fingerprint(paths))
+    return output_path
+
+
+if __name__ == "__main__":
+    output_path = convert(sys.argv[1])
+    print('Saved to', output_path.resolve())
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+# Fast Gaussian kernel density estimation for the distributions of offsets at each metric location
+# Samples are linearly binned onto the evaluation grid and convolved with the sampled kernel using an FFT,
+# so evaluating a density costs O(samples + grid log grid) rather than O(samples x grid) as with scipy.stats.gaussian_kde
+# Bandwidths are chosen as in gaussian_kde, so the estimates match its output to within the binning error
+
+
+# Returns the Gaussian kernel bandwidth (standard deviation) for samples, using the same rules as scipy.stats.gaussian_kde
+# bw_method is 'scott', 'silverman' or a scalar factor which multiplies the standard deviation of the samples
+def bandwidth(samples, bw_method='scott'):
+    n = len(samples)
+    if bw_method == 'scott':
+        factor = n ** (-1 / 5)
+    elif bw_method == 'silverman':
+        factor = (n * 3 / 4) ** (-1 / 5)
+    else:
+        factor = float(bw_method)
+    return factor * np.std(samples, ddof=1)
+
+
+# Evaluates the kernel density estimate of each array in samples_list on points evenly spaced points between its minimum and maximum
+# All the estimates are calculated together, binning every array in one pass and convolving them in one batched FFT
+# Returns a list of (grid, pdf) tuples in the same order
+def estimate(samples_list, points=1000, bw_method='scott'):
+    samples_list = [np.asarray(samples, dtype=np.float64) for samples in samples_list]
+    if not samples_list:
+        return []
+    counts = np.array([len(samples) for samples in samples_list])
+    lows = np.array([samples.min() for samples in samples_list])
+    highs = np.array([samples.max() for samples in samples_list])
+    bandwidths = np.array([bandwidth(samples, bw_method) for samples in samples_list])
+    steps = (highs - lows) / (points - 1)
+    steps[steps == 0] = 1
+
+    # Linear binning, splitting each sample between its two nearest grid points
+    rows = np.repeat(np.arange(len(samples_list)), counts)
+    positions = (np.concatenate(samples_list) - lows[rows]) / steps[rows]
+    left = np.minimum(positions.astype(np.int64), points - 2)
+    fraction = positions - left
+    bins = rows * points + left
+    binned = (np.bincount(bins, 1 - fraction, minlength=len(samples_list) * points) +
+              np.bincount(bins + 1, fraction, minlength=len(samples_list) * points)).reshape(-1, points)
+    binned /= counts[:, None]
+
+    # The kernel is sampled at every distance between two grid points, so it never needs truncating
+    # Samples with no spread have a bandwidth of 0 and a pdf of NaN (gaussian_kde raises an error for these instead)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = np.arange(-(points - 1), points)[None, :] * (steps / bandwidths)[:, None]
+        kernels = np.exp(-0.5 * distances ** 2) / (bandwidths[:, None] * np.sqrt(2 * np.pi))
+    size = 1 << int(np.ceil(np.log2(3 * points - 2)))
+    pdfs = np.fft.irfft(np.fft.rfft(binned, size) * np.fft.rfft(kernels, size), size)[:, points - 1:2 * points - 1]
+
+    # Round-off can leave tiny negative values where the density is close to 0
+    pdfs = np.maximum(pdfs, 0)
+    return [(np.linspace(low, high, points), pdf) for low, high, pdf in zip(lows, highs, pdfs)]
+
+
+# Draws size samples from the kernel density estimate of samples, using random_state (a numpy.random.RandomState or the numpy.random module)
+def resample(samples, size, bw_method='scott', random_state=np.random):
+    samples = np.asarray(samples, dtype=np.float64)
+    return samples[random_state.randint(0, len(samples), size)] + random_state.normal(0, bandwidth(samples, bw_method), size)
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Typed .csv loading: only the needed columns are parsed, with the multithreaded pyarrow engine for large files when it is installed,
+# and each column of whole numbers can then be stored in the smallest type which represents all of its values exactly
+# Columns of fractional values (e.g. onsets and phases) are kept as float64, as arithmetic on them in float32 would lose precision
+
+# Files smaller than this are parsed faster by the C engine, as starting pyarrow's threads costs more than it saves
+ARROW_MIN_SIZE = 2**20
+
+
+# Private function which returns series in the smallest lossless type: the smallest integer type for whole numbers (including 0/1 flags),
+# or float32 for whole numbers with missing values if no precision is lost. Any other column is returned unchanged
+def _downcast(series):
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+    values = series.to_numpy()
+    missing = np.isnan(values)
+    if not (values[~missing] == np.round(values[~missing])).all():
+        return series
+    if not missing.any():
+        return pd.to_numeric(series.astype(np.int64), downcast='integer')
+    single = values.astype(np.float32)
+    if np.array_equal(single.astype(np.float64), values, equal_nan=True):
+        return series.astype(np.float32)
+    return series
+
+
+# Downcasts every numeric column of df to its smallest lossless type in place, one column at a time to keep peak memory low, and returns df
+# Downcasting once after concatenating the files of a piece is cheaper than downcasting each file
+def downcast(df):
+    for column in df:
+        downcast_series = _downcast(df[column])
+        if downcast_series.dtype != df[column].dtype:
+            df[column] = downcast_series
+    return df
+
+
+# Reads a .csv file into a dataframe
+# columns is an optional list of the only columns to read (any which are None are ignored)
+def read_csv(path, columns=None):
+    usecols = [column for column in columns if column is not None] if columns is not None else None
+    engine = 'pyarrow' if pyarrow is not None and Path(path).stat().st_size >= ARROW_MIN_SIZE else 'c'
+    return pd.read_csv(path, usecols=usecols, engine=engine)
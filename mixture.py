@@ -0,0 +1,129 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+
+import cache
+
+
+# Fitting service for the spherical Gaussian mixture models used for mixture metric locations
+# Fitted models are memoized in memory and in cache/, keyed by a hash of the samples, the number of components and the parameters a fit was warm-started from,
+# so the same fit is only ever run once, whether it is needed for a plot or a table
+# Models are stored on disk as their fitted parameters in .npz files (never pickles), and only the most recent MAX_CACHED_MODELS are kept,
+# which is checked once per process rather than on every save
+RANDOM_STATE = 0
+MAX_CACHED_MODELS = 1000
+
+# Fitted attributes of a GaussianMixture which are stored on disk
+_ATTRIBUTES = ['weights_', 'means_', 'covariances_', 'precisions_', 'precisions_cholesky_', 'converged_', 'n_iter_', 'lower_bound_', 'n_features_in_']
+
+_models = {}
+_pruned = False
+
+
+# Private function which returns the parameters to warm-start a fit with the given number of components from previous, or an empty dictionary for a cold fit
+def _init(previous, components):
+    if previous is None or previous.n_components != components:
+        return {}
+    return dict(weights_init=previous.weights_, means_init=previous.means_, precisions_init=previous.precisions_)
+
+
+# Returns the memoization key for a set of samples and number of components, fitted from scratch or warm-started from previous
+def key(samples, components, previous=None):
+    digest = hashlib.sha256(np.ascontiguousarray(samples, dtype=np.float64).tobytes())
+    digest.update(str(components).encode())
+    for name, value in sorted(_init(previous, components).items()):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _path(key):
+    return cache.CACHE_DIR / f'mixture-{key[:16]}.npz'
+
+
+# Private function which fits a model from scratch, or starting from the parameters of previous if given
+def _fit(samples, components, previous=None):
+    return GaussianMixture(components, covariance_type="spherical", random_state=RANDOM_STATE, **_init(previous, components)).fit(samples)
+
+
+# Private function which reads a model stored by _save
+def _load(path, components):
+    model = GaussianMixture(components, covariance_type="spherical", random_state=RANDOM_STATE)
+    with np.load(path, allow_pickle=False) as data:
+        for name in _ATTRIBUTES:
+            value = data[name]
+            setattr(model, name, value.item() if value.ndim == 0 else value)
+    return model
+
+
+# Private function which removes the least recently stored models in cache/ beyond MAX_CACHED_MODELS
+# Other processes may be pruning at the same time, so models which have already gone are skipped
+def _prune():
+    stored = []
+    for stored_path in cache.CACHE_DIR.glob('mixture-*.npz'):
+        try:
+            stored.append((stored_path.stat().st_mtime_ns, stored_path))
+        except FileNotFoundError:
+            pass
+    for _, stale in sorted(stored)[:-MAX_CACHED_MODELS]:
+        stale.unlink(missing_ok=True)
+
+
+# Private function which stores the fitted parameters of a model in cache/, pruning the stored models on the first save in this process (see _prune)
+def _save(path, model):
+    global _pruned
+    cache.CACHE_DIR.mkdir(exist_ok=True)
+    with cache.atomic_path(path) as temporary_path, open(temporary_path, 'wb') as file:
+        np.savez(file, **{name: getattr(model, name) for name in _ATTRIBUTES})
+    if not _pruned:
+        _prune()
+        _pruned = True
+
+
+# Returns the memoized model for samples (warm-started from previous, if given), or None if it has not been fitted yet
+# If persist is True, models fitted in previous runs are also looked up in cache/
+def lookup(samples, components=2, persist=True, previous=None):
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, 1)
+    model_key = key(samples, components, previous)
+    if model_key not in _models and persist and _path(model_key).exists():
+        _models[model_key] = _load(_path(model_key), components)
+    return _models.get(model_key)
+
+
+# Private function which stores a fitted model in the memo, and on disk if persist is True
+def _store(samples, components, previous, model, persist):
+    model_key = key(samples, components, previous)
+    _models[model_key] = model
+    if persist:
+        _save(_path(model_key), model)
+
+
+# Fits a Gaussian mixture model with the given number of components to a series of samples
+# If previous is a model fitted to related data (e.g. before more takes were appended), fitting is warm-started from its parameters
+def fit(series, components=2, previous=None, persist=True):
+    return fit_all([series], components, [previous], persist=persist)[0]
+
+
+# Fits a Gaussian mixture model to each series in series_list, returning the models in the same order
+# Series which have not been fitted before are fitted concurrently across a pool of processes (all cores if processes is None)
+# previous is an optional list of models to warm-start each fit from
+# If persist is True, fitted models are also stored in cache/ and reused by later runs
+def fit_all(series_list, components=2, previous=None, processes=None, persist=True):
+    samples_list = [np.asarray(series, dtype=np.float64).reshape(-1, 1) for series in series_list]
+    previous = previous or [None] * len(samples_list)
+    models = [lookup(samples, components, persist, model) for samples, model in zip(samples_list, previous)]
+    pending = [i for i, model in enumerate(models) if model is None]
+
+    if len(pending) > 1 and processes != 1:
+        with ProcessPoolExecutor(min(processes or os.cpu_count(), len(pending))) as executor:
+            fitted = list(executor.map(_fit, [samples_list[i] for i in pending], [components] * len(pending), [previous[i] for i in pending]))
+    else:
+        fitted = [_fit(samples_list[i], components, previous[i]) for i in pending]
+
+    for i, model in zip(pending, fitted):
+        _store(samples_list[i], components, previous[i], model, persist)
+        models[i] = model
+    return models
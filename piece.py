@@ -1,14 +1,35 @@
+import hashlib
+import os
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
-from scipy.stats import gaussian_kde, norm, ttest_1samp
-from sklearn.mixture import GaussianMixture
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.stats import norm, ttest_1samp
 from tabulate import tabulate
 
+import cache
+import catalog
+import corpus
+import density
+import loader
+import mixture
+import profiling
+import resampling
+import rhythm
+import tempofit
+from stream import OnsetStream
+from summary import Summary
+
+
+# Fewest beats for which tempo_curves starts a pool of processes when processes is not given
+PARALLEL_TEMPO_BEATS = 200000
+
 
 # Class for performing micro-timing data analysis on a piece of music
 class Piece:
@@ -16,12 +37,72 @@ class Piece:
     # name is the name of the subfolder within data/ that the piece's .csv files are found
     # beat_divisions is a list of integers representing how many pulse units each beat in the metre can be divided into
     # mixture_metric_locations is a list of indices representing which beats should be treated as a Gaussian mixture model instead of a Normal distribution
-    def __init__(self, name, beat_divisions, mixture_metric_locations=None):
+    # use_cache controls whether loaded data is read from and written to the on-disk cache in cache/
+    def __init__(self, name, beat_divisions, mixture_metric_locations=None, use_cache=True):
         self.name = name
         self.beat_division = beat_divisions[0]
         self.beats = len(beat_divisions)
         self.pulse_units = sum(beat_divisions)
         self.mixture_metric_locations = mixture_metric_locations
+        self.use_cache = use_cache
+        self._mixtures = {}
+        self._indexed = None
+        self._load_lock = threading.RLock()
+
+    # Defers loading the piece's data until it is first used
+    # load_method is the name of a load method (e.g. 'load_processed'), which is called with args and kwargs when any data attribute (e.g. df) is first accessed
+    def defer(self, load_method, *args, **kwargs):
+        self._deferred = (load_method, args, kwargs)
+        return self
+
+    # Performs a deferred load now, if it has not already happened (and does nothing for a piece which was never deferred)
+    # If background is True, the load runs in a daemon thread which is returned; accessing data before it finishes waits for it
+    # The load method runs on a private copy of the piece, and its attributes are only published once it has finished,
+    # so no data is visible while it is still being normalized or filtered
+    def load(self, background=False):
+        if background:
+            thread = threading.Thread(target=self.load, daemon=True)
+            thread.start()
+            return thread
+        with self._load_lock:
+            if '_deferred' in self.__dict__:
+                load_method, args, kwargs = self._deferred
+                staging = object.__new__(type(self))
+                staging.__dict__.update((key, value) for key, value in self.__dict__.items() if key not in ('_deferred', '_load_lock'))
+                getattr(staging, load_method)(*args, **kwargs)
+                self.__dict__.update(staging.__dict__)
+                del self.__dict__['_deferred']
+
+    # Only called for attributes which do not exist, so triggers a deferred load the first time data is needed,
+    # waiting for it to finish if it is already running in the background
+    def __getattr__(self, name):
+        if name.startswith('_') or '_deferred' not in self.__dict__:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self.load()
+        return object.__getattribute__(self, name)
+
+    # Pieces are sent to worker processes unloaded if they have not been used yet, so the lock guarding a deferred load is recreated rather than pickled
+    # The index of the piece's rows (see indexed) is rebuilt on first use rather than pickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_load_lock', None)
+        state['_indexed'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_lock = threading.RLock()
+
+    # Returns the path that the figure drawn by method (plot_histogram or tempo) is saved to for a given file format (e.g. '.pgf') and output directory
+    def figure_path(self, method, save_format, output_dir=None):
+        suffix = '-tempo' if method == 'tempo' else ''
+        return Path(output_dir or '.') / (self.name + suffix + save_format)
+
+    # Returns a hash of the piece's loaded data, which changes whenever any value used by its analyses changes
+    # Processed pieces are hashed before onsets without a phase are filtered, as tempo analysis uses those onsets too
+    def data_hash(self):
+        df = self.df_valid if hasattr(self, 'df_valid') else self.df
+        return hashlib.sha256(pd.util.hash_pandas_object(df).to_numpy().tobytes()).hexdigest()
 
     # Private method which gets the Path objects for all .csv files for this piece
     # Can be filtered by any files with a given string in them
@@ -30,16 +111,54 @@ class Piece:
         return Path().glob(f'data/{self.name}/{filename}')
 
     # Private method that loads all .csv files for a piece and concatenates them into one dataframe
-    # Can be filtered by any files with a given string in them
-    def _load_joined(self, filter=''):
-        files = self._get_paths(filter)
-        self.df = pd.concat([pd.read_csv(file) for file in files])
+    # Can be filtered by any files with a given string in them, and restricted to a list of columns (see loader.read_csv)
+    # The name of the file each row came from is stored in the File column
+    def _load_joined(self, filter='', columns=None):
+        files = self._read_files(filter, columns)
+        dfs = [df for _, df in files]
+        self.df = loader.downcast(pd.concat(dfs))
+        self.df['File'] = pd.Categorical.from_codes(np.repeat(np.arange(len(dfs)), [len(df) for df in dfs]), [name for name, _ in files])
 
     # Private method that loads all .csv files for a piece and returns them as a list of dataframes
-    # Can be filtered by any files with a given string in them
-    def _load_separately(self, filter=''):
-        files = self._get_paths(filter)
-        return [pd.read_csv(file) for file in files]
+    # Can be filtered by any files with a given string in them, and restricted to a list of columns (see loader.read_csv)
+    # The name of the file each row came from is stored in the File column
+    def _load_separately(self, filter='', columns=None):
+        return [loader.downcast(df).assign(File=name) for name, df in self._read_files(filter, columns)]
+
+    # Private method which returns the path of the piece's corpus file (see corpus.py)
+    def _corpus_path(self):
+        return Path('data') / f'{self.name}.corpus'
+
+    # Private method which returns the piece's corpus file (see corpus.py), or None if there is none or it is out of date
+    # A corpus converted from the piece's .csv files is out of date once they change or the corpus format does (a warning is given, as it needs converting again),
+    # whereas one built by appending recordings (e.g. by the beat tracker) has no source, and is read alongside the .csv files (see _read_files)
+    def _corpus(self):
+        path = self._corpus_path()
+        if not path.exists():
+            return None
+        data = corpus.Corpus(path)
+        if data.version != corpus.VERSION:
+            warnings.warn(f'{path} is in an older corpus format and is ignored; run python corpus.py {self.name} to convert it again')
+            return None
+        if data.source is not None:
+            paths = list(self._get_paths())
+            if paths and not corpus.matches(data.source, paths):
+                warnings.warn(f'{path} is out of date with data/{self.name}/ and is ignored; run python corpus.py {self.name} to convert it again')
+                return None
+        return data
+
+    # Private method which returns a list of (file name, dataframe) pairs for the piece's files, with the same filter and columns as _load_joined
+    # Files are memory-mapped from the piece's corpus file if it is up to date, otherwise read from the .csv files
+    # A corpus with no source only holds appended recordings, so the .csv files it does not replace are read first
+    def _read_files(self, filter='', columns=None):
+        data = self._corpus()
+        files = []
+        if data is None or data.source is None:
+            stored = set() if data is None else set(data.names)
+            files = [(file.stem, loader.read_csv(file, columns)) for file in self._get_paths(filter) if file.stem not in stored]
+        if data is not None:
+            files += [(name, data.frame([name], columns)) for name in data.names if filter in name]
+        return files
 
     # Print the piece's dataframe (or optionally, any table recognised by tabulate) to the console
     def print(self, table=None):
@@ -53,71 +172,123 @@ class Piece:
     # The names of the columns representing each of these must be passed in as strings
     # Offset is calculated and it is converted to quarter lengths
     # Phase is converted to pulse units
+    # The normalized data is cached on disk and reused until any of the files or column names change
     def load_processed(self, onset=None, cycle_num=None, metric_loc=None, metric_loc_index=None, valid=None, phase=None, filter=''):
         if onset and metric_loc and valid and phase:
-            self._load_joined(filter)
             self.onset = onset
             self.cycle_num = cycle_num
             self.metric_loc = metric_loc
             self.metric_loc_index = metric_loc_index
             self.valid = valid
             self.phase = phase
-            # Calculate phase in pulse units
-            self.df[self.phase] = self.df[self.phase] * self.beat_division
-            # Calculate offset in pulse units
-            self.df['Offset_pulse_units'] = self.df[self.phase] - (self.df[self.metric_loc_index] - 1)
-            # Convert offset to quarter lengths
-            self.df['Offset'] = self.df['Offset_pulse_units'] / 2
-
-            # Filter invalid or nan values
-            self.df = self.df[self.df[self.valid] == 1]
-            self.df = self.df[self.df[self.phase].notna()]
+
+            key = None
+            if self.use_cache:
+                with profiling.stage('cache load', self.name) as stage:
+                    # The corpus file is included as well as the .csv files, so that recordings appended to it invalidate the cache
+                    paths = list(self._get_paths(filter)) + [path for path in [self._corpus_path()] if path.exists()]
+                    key = cache.fingerprint(paths, onset=onset, cycle_num=cycle_num, metric_loc=metric_loc, metric_loc_index=metric_loc_index, valid=valid, phase=phase, filter=filter, beat_division=self.beat_division)
+                    self.df_valid = cache.load(self.name, key)
+                    stage.rows = None if self.df_valid is None else len(self.df_valid)
+            if key is None or self.df_valid is None:
+                with profiling.stage('file read', self.name) as stage:
+                    self._load_joined(filter, [onset, cycle_num, metric_loc, metric_loc_index, valid, phase])
+                    stage.rows = len(self.df)
+                with profiling.stage('normalize', self.name, len(self.df)):
+                    # Calculate phase in pulse units
+                    self.df[self.phase] = self.df[self.phase] * self.beat_division
+                    # Calculate offset in pulse units
+                    self.df['Offset_pulse_units'] = self.df[self.phase] - (self.df[self.metric_loc_index] - 1)
+                    # Convert offset to quarter lengths
+                    self.df['Offset'] = self.df['Offset_pulse_units'] / 2
+
+                # Filter invalid values
+                with profiling.stage('filter', self.name, len(self.df)):
+                    self.df_valid = self.df[self.df[self.valid] == 1]
+                if key is not None:
+                    with profiling.stage('cache save', self.name, len(self.df_valid)):
+                        cache.save(self.name, key, self.df_valid)
+
+            # Filter nan values
+            # Valid onsets without a phase are kept in df_valid, as they are still needed for tempo analysis
+            with profiling.stage('filter', self.name, len(self.df_valid)):
+                self.df = self.df_valid[self.df_valid[self.phase].notna()]
+            self.files = catalog.parse_filenames([str(file) for file in self.df_valid['File'].unique()])
+            self._indexed = None
         else:
             print("Please provide column names for onset times, cycle numbers, metric locations, metric location indices, phase, and valid point")
 
     # Loads a piece which is unprocessed, i.e. only has onset values
     # Estimates metric locations and phase for data with onsets for only and all beats
-    # Assumes that only onsets on exact beats are included, the first onset is the first beat, and all beats are included with no discontinuities
-    def load_from_onsets(self, onset=None, filter='', dfs=None, drop=True):
+    # Assumes that only onsets on exact beats are included, the first onset is the first beat, and all beats are included with no discontinuities,
+    # unless snap_window is given, in which case missing beats are detected from the local tempo (see _onset_phases)
+    # All takes are processed together as one array, and onsets whose phase cannot be calculated (i.e. in an incomplete final cycle) are removed
+    def load_from_onsets(self, onset=None, filter='', dfs=None, drop=True, snap_window=None):
         if onset:
             if dfs is None:
-                dfs = self._load_separately(filter)
-            for df in dfs:
-
-                # Perform calculations to estimate phase
-                df['Cycle_number'] = (df.index // self.beats) + 1
-                df['Metric_location'] = df.index % self.beats
-
-                if drop:
-                    # Remove any incomplete bars from the end (apart from its first note)
-                    last_loc = int(df.iloc[-1]['Metric_location'])
-                    df.drop(df.tail(last_loc).index, inplace=True)
-
-                cycle_start_index = df.index - df['Metric_location']
-                cycle_end_index = (cycle_start_index + self.beats) % len(df)
-                cycle_start_onset = df.iloc[cycle_start_index][onset].reset_index(drop=True)
-                cycle_end_onset = df.iloc[cycle_end_index][onset].reset_index(drop=True)
-                cycle_duration = cycle_end_onset - cycle_start_onset
-                isochronous_beat_duration = cycle_duration / self.beats
-                isochronous_onset = cycle_start_onset + (df['Metric_location'] * isochronous_beat_duration)
-                offset_seconds = df[onset] - isochronous_onset
-                df['Offset'] = (offset_seconds / isochronous_beat_duration) * (self.beat_division / 2)
-                df['Phase'] = df['Offset'] + df['Metric_location']
-                df['Is_included_in_grid'] = 1
-
-                # Filter invalid or nan values
-                df = df[df['Phase'].notna()]    
-
-            self.df = pd.concat(dfs)
+                with profiling.stage('file read', self.name) as stage:
+                    dfs = self._load_separately(filter, [onset])
+                    stage.rows = sum(len(df) for df in dfs)
+            lengths = np.array([len(df) for df in dfs])
+            df = pd.concat(dfs, ignore_index=True)
+            with profiling.stage('phase estimation', self.name, len(df)):
+                takes, rows, cycles, locs, offsets = _onset_phases(df[onset].to_numpy(), lengths, self.beats, self.beat_division, drop, snap_window)
+
+            df = df.iloc[np.cumsum(lengths)[takes] - lengths[takes] + rows]
+            df.index = rows
+            df['Cycle_number'] = cycles
+            df['Metric_location'] = locs
+            df['Offset'] = offsets
+            df['Phase'] = offsets + locs
+            df['Is_included_in_grid'] = 1
+            if 'File' in df:
+                self.files = catalog.parse_filenames([str(file) for file in df['File'].unique()])
+            else:
+                # Dataframes passed in without a File column are numbered as takes in order
+                self.files = catalog.numbered_takes(len(dfs))
+                df['File'] = pd.Categorical.from_codes(takes, self.files.index)
+
+            self.df = df
+            bounds = np.searchsorted(takes, np.arange(len(dfs) + 1))
+            self.df_list = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
 
             self.onset = onset
+            self.cycle_num = 'Cycle_number'
             self.metric_loc = 'Metric_location'
             self.valid = 'Is_included_in_grid'
             self.phase = 'Phase'
-            self.df_list = dfs
+            self._indexed = None
         else:
             print("Please provide column name for onset times")
 
+    # Returns the piece's valid rows (including those without a phase, for processed pieces) indexed by take, instrument, cycle number and metric location
+    # The take and instrument of each row come from the metadata in files, which is parsed from the file names once when the piece is loaded (see catalog.py)
+    # The index is built on first use and shared by every analysis, so slicing by take or instrument never re-reads files or matches file names
+    def indexed(self):
+        files = self.files
+        if self._indexed is None:
+            df = self.df_valid if 'df_valid' in self.__dict__ else self.df
+            self._indexed = catalog.build_index(df, files, self.cycle_num, self.metric_loc)
+        return self._indexed
+
+    # Returns the rows of indexed for a take, instrument, cycle number and metric location, where any left as None match every value
+    # e.g. select(take=4, instrument='Jembe1') returns all Jembe1 cycles of take 4. Instruments are matched without case or hyphens
+    # As the index is sorted, each slice is found by binary search rather than by scanning every row
+    def select(self, take=None, instrument=None, cycle=None, metric_location=None):
+        df = self.indexed()
+        if instrument is not None:
+            instrument = catalog.instrument_name(instrument)
+        key = tuple(slice(None) if value is None else value for value in (take, instrument, cycle, metric_location))
+        try:
+            return df.loc[key, :]
+        except KeyError:
+            return df.iloc[:0]
+
+    # Returns a stream (see stream.OnsetStream) which incrementally calculates phase and offset for live onset data, using this piece's metre
+    # onset is the name of the onset column in the dataframes it emits
+    def stream(self, onset='Onset'):
+        return OnsetStream(self.beats, self.beat_division, onset)
+
     # Private method to use maximum likelihood estimation to fit and plot (on axis) a Normal distribution to a series
     # Optionally also resamples values from the fitted distribution and plots these
     def _plot_mle(self, series, axis, resample=False):
@@ -135,8 +306,7 @@ class Piece:
     # Optionally also resamples values from the fitted distribution and plots these
     def _plot_mixture_mle(self, series, axis, components=2, resample=False):
         x_grid = np.linspace(min(series), max(series), len(series)).reshape(-1,1)
-        samples = np.array(series).reshape(-1, 1)
-        gm = GaussianMixture(components, covariance_type="spherical").fit(samples)
+        gm = mixture.fit(series, components, persist=self.use_cache)
         logprob = gm.score_samples(x_grid)
         pdf = np.exp(logprob)
         axis.plot(x_grid, pdf)
@@ -148,36 +318,42 @@ class Piece:
     # Suitable for data which does not fit a Normal (or any standard) distribution, or where the exact shape of the data should be preserved
     # This approach was discarded in favour of maximum likelihood estimation
     # Optionally also resamples values from the fitted distribution and plots these
-    def _plot_kde(self, series, axis, resample=False):
-        kde = gaussian_kde(series)
-        x_grid = np.linspace(min(series), max(series), 1000)
-        pdf = kde.evaluate(x_grid)
+    # estimate is the (grid, pdf) tuple for series from density.estimate, if it has already been calculated
+    def _plot_kde(self, series, axis, resample=False, estimate=None):
+        x_grid, pdf = estimate if estimate is not None else density.estimate([series])[0]
         axis.plot(x_grid, pdf)
         if resample:
-            axis.hist(kde.resample(len(series)).ravel(), bins=20, density=True, stacked=True, alpha=0.5, label='KDE samples')
+            axis.hist(density.resample(series, len(series)), bins=20, density=True, stacked=True, alpha=0.5, label='KDE samples')
             axis.legend()
 
     # Plots a histogram of the distributions of timings for each metric location, either on separate or a combined plot
     # mle (maximum likelihood estimation) and kde (kernel density estimation) arguments being True will fit the corresponding distribution to the data and plot its PDF
     # Optionally also resamples values from the fitted distribution and plots these
-    def plot_histogram(self, separately=False, mle=True, kde=False, resample=False, save_format=None, figsize=(6.52, 1.5)):
+    # If save_format is given, the figure is saved to output_dir (default the working directory), and if show is False it is not displayed
+    # processes is passed to fit_mixtures, e.g. 1 when already running in a worker process
+    def plot_histogram(self, separately=False, mle=True, kde=False, resample=False, save_format=None, figsize=(6.52, 1.5), output_dir=None, show=True, processes=None):
         df = self.df
-        metric_locations = df[self.metric_loc].unique()
-        metric_locations.sort()
+        groups = df.groupby(self.metric_loc)
+        if mle:
+            # Fit all mixture models up front, in parallel
+            self.fit_mixtures('Offset' if separately else self.phase, processes=processes)
+        if kde:
+            # Estimate all densities up front, in one batch
+            with profiling.stage('density estimate', self.name, len(df)):
+                estimates = density.estimate([group['Offset' if separately else self.phase] for _, group in groups])
         
         if separately:
-            axs = df.hist('Offset', by=self.metric_loc, bins=20, density=True, stacked=True, alpha=(0.5 if resample else 0.7), layout=(len(metric_locations)//3, 3), figsize=figsize, rot=0)
+            axs = df.hist('Offset', by=self.metric_loc, bins=20, density=True, stacked=True, alpha=(0.5 if resample else 0.7), layout=(groups.ngroups//3, 3), figsize=figsize, rot=0)
             if mle or kde:
-                for i in range(len(metric_locations)):
-                    location = metric_locations[i]
-                    series = df[df[self.metric_loc] == location]['Offset']
+                for i, (location, group) in enumerate(groups):
+                    series = group['Offset']
                     if mle:
                         if self.mixture_metric_locations and location in self.mixture_metric_locations:
                             self._plot_mixture_mle(series, axs.flat[i], resample=resample)
                         else:
                             self._plot_mle(series, axs.flat[i], resample=resample)
                     if kde:
-                        self._plot_kde(series, axs.flat[i], resample=resample)
+                        self._plot_kde(series, axs.flat[i], resample=resample, estimate=estimates[i])
                     axs.flat[i].axvline(0, color="grey", linestyle='--', linewidth=1.0, alpha=0.8)
                     axs.flat[i].set_title(f'Beat {int(location) + 1}')
                     axs.flat[i].set_xlabel('Offset')
@@ -189,12 +365,12 @@ class Piece:
             plt.xlabel('Metric event')
             plt.ylabel('Density')
             colour = 0
-            for location in metric_locations:
-                series = df[df[self.metric_loc] == location][self.phase]
+            for i, (location, group) in enumerate(groups):
+                series = group[self.phase]
                 plt.hist(series, bins=20, density=True, stacked=True, alpha=(0.5 if resample else 0.7), color=f'C{colour // self.beat_division}')
                 colour += 1
 
-                loc_index = df[df[self.metric_loc] == location][self.metric_loc_index].iloc[0] - 1
+                loc_index = group[self.metric_loc_index].iloc[0] - 1
                 plt.axvline(loc_index, color="grey", linestyle='--', linewidth=1.0, alpha=0.8)
                 
                 if mle:
@@ -203,216 +379,461 @@ class Piece:
                     else:
                         self._plot_mle(series, plt)
                 if kde:
-                    self._plot_mle(series, plt)
+                    self._plot_kde(series, plt, estimate=estimates[i])
             plt.xticks(np.arange(0, self.pulse_units, 1.0))
         if save_format is not None:
-            plt.savefig(self.name + save_format, bbox_inches="tight", dpi=400)
-            print('Saved to',self.name + save_format)
-        plt.show()
-
-    # Prints maximum likelihood estimates of the mean and standard deviation of a fitted Normal distribution for each metric location
+            path = self.figure_path('plot_histogram', save_format, output_dir)
+            with profiling.stage('render', self.name):
+                plt.savefig(path, bbox_inches="tight", dpi=400)
+            print('Saved to',path)
+        if show:
+            plt.show()
+
+    # Private method that adds beat and pulse unit indices to a dataframe with a metric location column, inserting them at column position
+    def _add_location_indices(self, df, position=0):
+        locations = df[self.metric_loc]
+        beat = np.floor(locations)
+        df.insert(position, 'Pulse unit index', np.rint((10/self.beat_division) * (locations - beat)).astype(int))
+        df.insert(position, 'Beat index', beat.astype(int))
+        return df
+
+    # Computes the mean, standard deviation, count, and quantiles of the offsets for every metric location in a single grouped pass
+    # by is an optional list of columns to group by before metric location, e.g. ['File'] for separate statistics per take and instrument
+    # Returns a tidy dataframe with one row per group and metric location
+    def location_stats(self, by=None, quantiles=(0.25, 0.5, 0.75)):
+        keys = list(by or []) + [self.metric_loc]
+        with profiling.stage('grouping', self.name, len(self.df)):
+            grouped = self.df.groupby(keys)['Offset']
+            stats = grouped.agg(['mean', 'std', 'count'])
+            stats.columns = ['Mean', 'Standard deviation', 'Count']
+            if quantiles:
+                quantile_stats = grouped.quantile(list(quantiles)).unstack()
+                quantile_stats.columns = [f'Quantile {q}' for q in quantile_stats.columns]
+                stats = stats.join(quantile_stats)
+        return self._add_location_indices(stats.reset_index(), len(keys) - 1)
+
+    # Aligns the onsets of every pair of instruments in each take by cycle and metric location, and returns the asynchrony of each aligned pair of onsets
+    # (the second instrument's onset minus the first's, in the units of the onset column) as a tidy dataframe with one row per take, cycle, metric location and pair
+    # instruments is an optional list of instruments to compare (default all). Each instrument's onsets are given a sorted integer key for their take, cycle
+    # and pulse unit (from the metric location index column), and every pair is matched with a sorted merge join of their keys, so no pair of onsets is ever compared in a loop
+    # If an instrument has more than one onset for the same take, cycle and pulse unit, only the first is aligned and a warning is given
+    def asynchronies(self, instruments=None):
+        df = self.indexed()
+        df = df[df[self.phase].notna()]
+        take_codes, takes = pd.factorize(df.index.get_level_values('Take'))
+        cycles = df[self.cycle_num].to_numpy().astype(np.int64)
+        cycles -= cycles.min(initial=0)
+        pulses = df[self.metric_loc_index].to_numpy().astype(np.int64) - 1
+        keys = (take_codes * (cycles.max(initial=0) + 1) + cycles) * (pulses.max(initial=0) + 1) + pulses
+        onsets = df[self.onset].to_numpy(dtype=np.float64)
+        names = df.index.get_level_values('Instrument')
+        if instruments is None:
+            instruments = sorted(set(names))
+        instruments = [catalog.instrument_name(instrument) for instrument in instruments]
+
+        # Sorted unique keys of each instrument's onsets, with the position of the first onset for each key
+        positions = {}
+        for instrument in instruments:
+            rows = np.flatnonzero(names == instrument)
+            instrument_keys, first = np.unique(keys[rows], return_index=True)
+            if len(instrument_keys) < len(rows):
+                warnings.warn(f'{instrument} has {len(rows) - len(instrument_keys)} onsets at the same take, cycle and pulse unit as an earlier onset in {self.name}, which are not aligned')
+            positions[instrument] = (instrument_keys, rows[first])
+
+        frames = []
+        for i, first_instrument in enumerate(instruments):
+            for second_instrument in instruments[i + 1:]:
+                _, first_index, second_index = np.intersect1d(positions[first_instrument][0], positions[second_instrument][0], assume_unique=True, return_indices=True)
+                first_rows = positions[first_instrument][1][first_index]
+                second_rows = positions[second_instrument][1][second_index]
+                frames.append(pd.DataFrame({
+                    'Take': takes[take_codes[first_rows]],
+                    self.cycle_num: df[self.cycle_num].to_numpy()[first_rows],
+                    self.metric_loc: df[self.metric_loc].to_numpy()[first_rows],
+                    'Instrument 1': first_instrument,
+                    'Instrument 2': second_instrument,
+                    'Asynchrony': onsets[second_rows] - onsets[first_rows],
+                }))
+        columns = ['Take', self.cycle_num, self.metric_loc, 'Instrument 1', 'Instrument 2', 'Asynchrony']
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    # Computes the mean, standard deviation, count, and quantiles of the asynchronies (see asynchronies) between every pair of instruments at every metric location
+    # Takes are aggregated together, unless by is given, e.g. ['Take'] for separate statistics per take
+    # Returns a tidy dataframe with one row per pair of instruments, group and metric location
+    def asynchrony_stats(self, instruments=None, by=None, quantiles=(0.25, 0.5, 0.75)):
+        keys = ['Instrument 1', 'Instrument 2'] + list(by or []) + [self.metric_loc]
+        grouped = self.asynchronies(instruments).groupby(keys)['Asynchrony']
+        stats = grouped.agg(['mean', 'std', 'count'])
+        stats.columns = ['Mean', 'Standard deviation', 'Count']
+        if quantiles:
+            quantile_stats = grouped.quantile(list(quantiles)).unstack()
+            quantile_stats.columns = [f'Quantile {q}' for q in quantile_stats.columns]
+            stats = stats.join(quantile_stats)
+        return self._add_location_indices(stats.reset_index(), len(keys) - 1)
+
+    # Returns a compact summary (see summary.Summary) of the offsets at every metric location, as a dictionary keyed by metric location
+    # by is an optional list of columns to summarize separately for, e.g. ['File'], in which case keys are tuples ending in the metric location
+    # Summaries from different takes, pieces or workers can be combined with summary.merge_all
+    def summaries(self, by=None):
+        keys = list(by) + [self.metric_loc] if by else self.metric_loc
+        stats = self.df.groupby(keys)['Offset'].agg(['count', 'mean', 'var'])
+        return {key: Summary(int(row['count']), row['mean'], row['var'] * (row['count'] - 1) if row['count'] > 1 else 0.0) for key, row in stats.iterrows()}
+
+    # Converts a dictionary of summaries keyed by metric location into a table with the same columns as mle
+    def summary_table(self, summaries):
+        table = pd.DataFrame({self.metric_loc: list(summaries), 'Mean': [s.mean for s in summaries.values()], 'Standard deviation': [s.stddev() for s in summaries.values()]})
+        table = self._add_location_indices(table.sort_values(self.metric_loc, ignore_index=True))
+        return table[['Beat index', 'Pulse unit index', 'Mean', 'Standard deviation']]
+
+    # Fits a Gaussian mixture model to the values in column for every mixture metric location, with all fits running in parallel
+    # by is an optional list of columns to fit separately for, e.g. ['File'] for a fit per take
+    # Returns a dictionary mapping each metric location (or tuple of by values and metric location) to its fitted model
+    # Fitted models are memoized, and models from earlier calls are reused if their data is unchanged, or used to warm-start fits whose data has since changed
+    def fit_mixtures(self, column='Offset', by=None, components=2, processes=None):
+        if not self.mixture_metric_locations:
+            return {}
+        df = self.df[self.df[self.metric_loc].isin(self.mixture_metric_locations)]
+        groups = dict(list(df.groupby(list(by) + [self.metric_loc] if by else self.metric_loc)[column]))
+        data_keys = {key: mixture.key(series.to_numpy(), components) for key, series in groups.items()}
+        models = {}
+        previous = {}
+        for key in groups:
+            data_key, model = self._mixtures.get((column, components, key), (None, None))
+            if data_key == data_keys[key]:
+                models[key] = model
+            else:
+                previous[key] = model
+        with profiling.stage('model fit', self.name, len(df)):
+            fitted = mixture.fit_all([groups[key] for key in previous], components, list(previous.values()), processes, self.use_cache)
+        for key, model in zip(previous, fitted):
+            self._mixtures[(column, components, key)] = (data_keys[key], model)
+            models[key] = model
+        return {key: models[key] for key in groups}
+
+    # Returns maximum likelihood estimates of the mean and standard deviation of a fitted Normal distribution for each metric location
     # If a Gaussian mixture model was used, the component with smallest mean is chosen
-    # Data is printed in a CSV-like format
-    def print_mle(self):
-        df = self.df
-        metric_locations = df[self.metric_loc].unique()
-        metric_locations.sort()
-
-        print('Beat index,Pulse unit index,Mean,Standard deviation')
-        for location in metric_locations:
-            series = df[df[self.metric_loc] == location]['Offset']
-            if self.mixture_metric_locations and location in self.mixture_metric_locations:
-                samples = np.array(series).reshape(-1, 1)
-                gm = GaussianMixture(2, covariance_type="spherical").fit(samples)
+    # processes is passed to fit_mixtures, e.g. 1 to fit in this process when already running in a worker
+    def mle(self, processes=None):
+        stats = self.location_stats(quantiles=None)
+        models = self.fit_mixtures(processes=processes)
+        for i, location in stats[self.metric_loc].items():
+            if location in models:
+                gm = models[location]
                 component_index = np.argmin(gm.means_)
-                mean = gm.means_[component_index][0]
-                stddev = gm.covariances_[component_index]
-            else:
-                mean = series.mean()
-                stddev = series.std()
-            beat = int(np.floor(location))
-            pulse_unit = int(np.rint((10/self.beat_division) * (location - beat)))
-            print(beat,',',pulse_unit,',',mean,',',stddev, sep='')
-
-    # Private method for evaluating a general natural logarithmic function
-    def _logf(self, x, a, b, c):
-        return a * np.log(x + b) + c
+                stats.loc[i, 'Mean'] = gm.means_[component_index][0]
+                stats.loc[i, 'Standard deviation'] = gm.covariances_[component_index]
+        return stats[['Beat index', 'Pulse unit index', 'Mean', 'Standard deviation']]
 
-    # Private method for evaluating a general quadratic function
-    def _quadraticf(self, x, a, b, c):
-        return (a * (x**2)) + (b * x) + c
+    # Prints maximum likelihood estimates of the mean and standard deviation for each metric location (see mle)
+    # Data is printed in a CSV-like format
+    def print_mle(self):
+        print(self.mle().to_csv(index=False), end='')
 
-    # Private method for evaluating a general logarithmic function below tempo_cutoff, and a general quadratic function above
+    # Private method for evaluating a general logarithmic function below tempo_cutoff, and a general quadratic function above (see tempofit.combined)
     def _combinedf(self, x, a, b, c, d, e, f):
-        return np.where(x < self.tempo_cutoff, self._logf(x,a,b,c), self._quadraticf(x,d,e,f))
+        return tempofit.combined(x, self.tempo_cutoff, a, b, c, d, e, f)
+
+    # Private method that returns the onset times of every beat played by beat_instrument, as a dictionary mapping each take's file name to an array
+    def _beat_onsets(self, beat_instrument):
+        df = self.select(instrument=beat_instrument)
+        # Filter to just beats
+        df = df[df[self.metric_loc].isin(np.arange(self.beats))]
+        return {str(file): file_df[self.onset].to_numpy() for file, file_df in df.groupby('File', sort=False, observed=True)}
+
+    # Computes a tempo curve for every take of beat_instrument
+    # Each beat's progress through its take (as a percentage) is rounded to resolution, and the tempos of beats with the same progress are averaged
+    # Returns a dataframe of tempos and a dataframe of tempos averaged with a sliding window of window progress values within each take,
+    # both indexed by every progress value of any take with one column per take (NaN where a take has no beat), and a series of the duration of each take
+    # Takes are processed in parallel across a pool of processes (all cores if processes is None) only if there are at least PARALLEL_TEMPO_BEATS beats,
+    # as starting the pool costs far more than processing a few thousand beats
+    def tempo_curves(self, beat_instrument, resolution=0.1, window=10, processes=None):
+        takes = self._beat_onsets(beat_instrument)
+        beats = sum(len(onsets) for onsets in takes.values())
+        args = (list(takes.values()), [resolution] * len(takes), [window] * len(takes))
+        with profiling.stage('tempo curves', self.name, beats):
+            if len(takes) > 1 and processes != 1 and (processes is not None or beats >= PARALLEL_TEMPO_BEATS):
+                with ProcessPoolExecutor(processes) as executor:
+                    results = list(executor.map(_tempo_curve, *args, chunksize=max(1, len(takes) // (4 * (processes or os.cpu_count())))))
+            else:
+                results = list(map(_tempo_curve, *args))
+        index = pd.Index(np.unique(np.concatenate([grid for grid, _, _, _ in results])), name='Progress')
+        tempos = {take: pd.Series(tempo, grid).reindex(index) for take, (grid, tempo, _, _) in zip(takes, results)}
+        average_tempos = {take: pd.Series(average_tempo, grid).reindex(index) for take, (grid, _, average_tempo, _) in zip(takes, results)}
+        return (pd.DataFrame(tempos, index=index),
+                pd.DataFrame(average_tempos, index=index),
+                pd.Series([duration for _, _, _, duration in results], index=list(takes), name='Duration'))
+
+    # Averages the tempo curves of all takes (as returned by tempo_curves) at each point in the piece, ignoring takes with no beat at that point
+    # Returns a dataframe indexed by progress with the mean tempo, and its mean and standard deviation over a sliding window of window progress values
+    def ensemble_tempo(self, tempos, window=10):
+        m = pd.DataFrame({'Tempo': tempos.mean(axis=1)})
+        m['Average Tempo'] = m['Tempo'].rolling(window=window).mean()
+        m['Tempo stddev'] = m['Tempo'].rolling(window=window).std()
+        return m
+
+    # Private method that fits the tempo model to a tempo curve at tempo_cutoff (see tempofit.fit), returning its parameters, their covariance, the residuals,
+    # and the cutoff, which is the best one found between min_cutoff and max_cutoff if tempo_cutoff is None
+    # If the fit fails, the parameters and covariance are NaN
+    def _fit_tempo(self, curve, tempo_cutoff, min_cutoff=None, max_cutoff=None):
+        curve = curve.dropna()
+        x = curve.index.to_numpy()
+        y = curve.to_numpy()
+        with profiling.stage('curve fit', self.name, len(y)):
+            return tempofit.fit(x, y, tempo_cutoff, min_cutoff, max_cutoff)
+
+    # Fits the tempo model (see tempo) to the averaged tempo curve of each take of beat_instrument, and to the ensemble average of all takes
+    # If tempo_cutoff is None, the best cutoff between min_cutoff and max_cutoff is found for each take separately
+    # Returns a dataframe with one row per take and a final 'Ensemble' row, with columns for the parameters a-f, the cutoff, their covariance matrix,
+    # the residuals of the fit, and the duration
+    def tempo_fits(self, beat_instrument, tempo_cutoff=None, resolution=0.1, window=10, processes=None, min_cutoff=None, max_cutoff=None):
+        tempos, average_tempos, durations = self.tempo_curves(beat_instrument, resolution, window, processes)
+        curves = dict(average_tempos.items())
+        curves['Ensemble'] = self.ensemble_tempo(tempos, window)['Average Tempo']
+        durations['Ensemble'] = durations.mean()
+
+        rows = []
+        for take, curve in curves.items():
+            popt, pcov, residuals, cutoff = self._fit_tempo(curve, tempo_cutoff, min_cutoff, max_cutoff)
+            rows.append([take, *popt, cutoff, pcov, residuals, durations[take]])
+        return pd.DataFrame(rows, columns=['Take', 'a', 'b', 'c', 'd', 'e', 'f', 'Cutoff', 'Covariance', 'Residuals', 'Duration']).set_index('Take')
 
     # Tempo analysis for Jembe music
     # Analyses the changing tempo according to beat_instrument, which is any instrument which plays on each beat (often Jembe 2)
     # Assumes tempo can be modelled as roughly logarithmic until tempo_cutoff %, after which it is quadratic
     # i.e. y = a log(x+b) + c for x < tempo_cutoff, and y = dx^2 + ex + f for x >= tempo_cutoff
+    # If tempo_cutoff is None, the cutoff which fits the average tempo best between min_cutoff and max_cutoff is used, and printed with the parameters
     # Plots tempo curve for each take and the average tempo, fits curves to the average tempo and plots them, and prints parameters
     # Tempo is averaged with a sliding window of size 10
     # Also calculates and prints average duration of the piece across all takes
-    def tempo(self, beat_instrument, tempo_cutoff, save_format=None, figsize=(6,3.5)):
-        dfs = self._load_separately(beat_instrument)
-        self.tempo_cutoff = tempo_cutoff
-        dfs_new = []
-        for df in dfs:
-            df.drop(df[df[self.valid] != 1].index, inplace=True)
-            # Filter to just beats
-            df.drop(df[~df[self.metric_loc].isin(np.arange(self.beats))].index, inplace=True)
-            # Redefine Onset_time column to allow shift
-            df['Onset_time'] = df[self.onset]
-            df['Tempo'] = 60 / (df.Onset_time - df.Onset_time.shift(1))
-            first_onset = df[self.onset].iloc[0]
-            last_onset = df[self.onset].iloc[-1]
-            duration = last_onset - first_onset
-            df['Duration'] = duration
-            # Percentage progress throughout the piece
-            progress = ((df[self.onset] - first_onset) / duration) * 100
-            df['Progress'] = progress.round(1)
-            df = df.groupby(['Progress'], as_index=False).mean()
-            df['Average Tempo'] = df['Tempo'].rolling(window=10).mean()
-            plt.plot(df['Progress'], df['Average Tempo'], linewidth=0.5, alpha=0.5, color='gray')
-            dfs_new.append(df)
-        df = pd.concat(dfs_new)
-
-        m = df.groupby(['Progress'], as_index=False).mean()
-        m['Average Tempo'] = m['Tempo'].rolling(window=10).mean()
-        m['Tempo stddev'] = m['Tempo'].rolling(window=10).std()
-        plt.plot(m['Progress'], m['Average Tempo'])
-        plt.fill_between(m['Progress'], m['Average Tempo'] - m['Tempo stddev'], m['Average Tempo'] + m['Tempo stddev'], color='C0', alpha=0.2)
+    # If save_format is given, the figure is saved to output_dir (default the working directory), and if show is False it is not displayed
+    # processes is passed to tempo_curves, e.g. 1 when already running in a worker process
+    def tempo(self, beat_instrument, tempo_cutoff=None, save_format=None, figsize=(6,3.5), output_dir=None, show=True, min_cutoff=None, max_cutoff=None, processes=None):
+        tempos, average_tempos, durations = self.tempo_curves(beat_instrument, processes=processes)
+        for _, curve in average_tempos.items():
+            curve = curve.dropna()
+            plt.plot(curve.index, curve, linewidth=0.5, alpha=0.5, color='gray')
+
+        m = self.ensemble_tempo(tempos)
+        plt.plot(m.index, m['Average Tempo'])
+        plt.fill_between(m.index, m['Average Tempo'] - m['Tempo stddev'], m['Average Tempo'] + m['Tempo stddev'], color='C0', alpha=0.2)
 
         m = m.dropna()
-        popt,_ = curve_fit(self._combinedf, m['Progress'], m['Average Tempo'])
+        popt, _, _, self.tempo_cutoff = self._fit_tempo(m['Average Tempo'], tempo_cutoff, min_cutoff, max_cutoff)
         a,b,c,d,e,f = popt
         print('Params:')
+        if tempo_cutoff is None:
+            print('cutoff =', self.tempo_cutoff)
         print('a =', a)
         print('b =', b)
         print('c =', c)
         print('d =', d)
         print('e =', e)
         print('f =', f)
-        plt.plot(m['Progress'], self._combinedf(m['Progress'],a,b,c,d,e,f), color='black')
+        plt.plot(m.index, self._combinedf(m.index,a,b,c,d,e,f), color='black')
 
-        dur = df['Duration'].unique()
-        print('Mean duration:', dur.mean())
+        print('Mean duration:', durations.mean())
         
         plt.xlabel('Relative position in the piece (%)')
         plt.ylabel('Tempo (bpm)')
 
-        plt.annotate(f'$y={np.round(a,1)} \ln(x+{np.round(b,1)})+{np.round(c,1)}$', xy=(40,152.84), xytext=(60,135), arrowprops=dict(arrowstyle="->",connectionstyle="arc3,rad=-0.3"))
-        plt.annotate(f'$y={np.round(d,2)}x^2+{np.round(e,1)}x{int(np.round(f,0))}$', xy=(97,173), xytext=(30,185), arrowprops=dict(arrowstyle="->",connectionstyle="arc3,rad=-0.3",shrinkB=4))
+        # Label each segment of the fitted curve, pointing at the middle of the quadratic segment and 40% of the way through the logarithmic one
+        log_x = 0.4 * self.tempo_cutoff
+        quadratic_x = (self.tempo_cutoff + m.index.max()) / 2
+        plt.annotate(rf'$y={a:.1f} \ln(x{b:+.1f}){c:+.1f}$', xy=(log_x, self._combinedf(log_x,a,b,c,d,e,f)), xytext=(0.55,0.1), textcoords='axes fraction', arrowprops=dict(arrowstyle="->",connectionstyle="arc3,rad=-0.3"))
+        plt.annotate(f'$y={d:.2f}x^2{e:+.1f}x{f:+.0f}$', xy=(quadratic_x, self._combinedf(quadratic_x,a,b,c,d,e,f)), xytext=(0.25,0.9), textcoords='axes fraction', arrowprops=dict(arrowstyle="->",connectionstyle="arc3,rad=-0.3",shrinkB=4))
 
         if save_format is not None:
             fig = plt.gcf()
             fig.set_size_inches(figsize)
-            plt.savefig(self.name + '-tempo' + save_format, bbox_inches="tight")
-        plt.show()
-
+            with profiling.stage('render', self.name):
+                plt.savefig(self.figure_path('tempo', save_format, output_dir), bbox_inches="tight")
+        if show:
+            plt.show()
+
+
+    # Private method that encodes the rhythm pattern of every cycle played by instrument (see rhythm.encode_cycles)
+    # Takes are identified by their take number, so that the cycles of different instruments in the same take can be aligned
+    def _cycle_patterns(self, instrument):
+        df = self.select(instrument=instrument)
+        df = df[df[self.phase].notna()]
+        with profiling.stage('encode cycles', self.name, len(df)):
+            return rhythm.encode_cycles(df.index.get_level_values('Take'), df[self.cycle_num], df[self.metric_loc_index], self.pulse_units)
+
+    # Fits a Markov model of the rhythm patterns for a given instrument, using the previous order cycles as context
+    # If given is another instrument, each cycle is also conditioned on that instrument's cycle at the same time in the same take
+    # The returned model (see rhythm.ContextModel) can be sampled from many times
+    def rhythm_model(self, instrument, order=2, given=None):
+        patterns = self._cycle_patterns(instrument)
+        conditions = None
+        if given is not None:
+            # Only keep cycles which both instruments play
+            aligned = pd.concat([patterns, self._cycle_patterns(given)], axis=1, join='inner', keys=['Pattern', 'Given'])
+            patterns = aligned['Pattern']
+            conditions = [take['Given'].to_numpy() for _, take in aligned.groupby(level=0, sort=False)]
+        sequences = [take.to_numpy() for _, take in patterns.groupby(level=0, sort=False)]
+        return rhythm.ContextModel(sequences, order, conditions)
 
     # Analyses the rhythm patterns for a given instrument and generates a random sequence of cycles according to cycle transition probabilities
     # If int_output is True, the output will be a list of integers. Each integer's binary expansion corresponds to which metrical locations are onsets
     # Otherwise, the output will be a list of lists
-    def rhythm_sequence(self, instrument, num_of_samples, int_output=False):
-        dfs = self._load_separately(instrument)
-        cycle_onsets = []
-        starting_cycles = []
-
-        for df in dfs:
-            df.drop(df[df[self.valid] != 1].index, inplace=True)
-            df.drop(df[df[self.phase].isna()].index, inplace=True)
-            cycles = df[self.cycle_num].unique()
-            first = True
-            for cycle in cycles:
-                onsets = []
-                locs = df[df[self.cycle_num] == cycle][self.metric_loc_index].unique()
-                for i in range(self.pulse_units):
-                    # Record whether there is an onset at this position in this cycle
-                    is_played = 1 if i+1 in locs else 0
-                    onsets.append(is_played)
-
-                # Convert list of 1s and 0s to an integer
-                number = int("".join(str(i) for i in onsets),2)
-                cycle_onsets.append(number)
-                if first:
-                    starting_cycles.append(number)
-                first = False
-
-        # Count transitions between cycles
-        trans_counts = {}
-        for i in range(len(cycle_onsets)-1):
-            num = cycle_onsets[i]
-            next = cycle_onsets[i+1]
-            if num not in trans_counts:
-                trans_counts[num] = {}
-            if next not in trans_counts[num]:
-                trans_counts[num][next] = 0
-            trans_counts[num][next] += 1
-
-        # Calculate transition probabilities
-        trans_probs = {}
-        for (k,v) in trans_counts.items():
-            trans_probs[k] = {k1: v1 / sum(v.values()) for k1, v1 in v.items()}
-
-        # Helper function to take an integer and return its binary expansion as a list
-        def to_binary(n):
-            return [int(x) for x in bin(n)[2:].zfill(self.pulse_units)]
-
-        # Generate random sequence of cycles
-        num = np.random.choice(starting_cycles)
-        if int_output:
-            nums = [num]
+    # If order is greater than 1, each cycle depends on the previous order cycles (see rhythm_model)
+    # random_state is a numpy RandomState to draw from (defaults to the global one, so np.random.seed makes sequences reproducible)
+    def rhythm_sequence(self, instrument, num_of_samples, int_output=False, order=1, random_state=np.random):
+        if order == 1:
+            patterns = self._cycle_patterns(instrument)
+            with profiling.stage('model fit', self.name, len(patterns)):
+                model = rhythm.MarkovChain(patterns.to_numpy(), rhythm.first_cycles(patterns))
+            with profiling.stage('sample', self.name, num_of_samples):
+                nums = model.sample(num_of_samples, random_state=random_state)
         else:
-            nums = [to_binary(num)]
-        for i in range(num_of_samples):
-            probs = trans_probs[num]
-            next = np.random.choice(list(probs.keys()), p=list(probs.values()))
-            if int_output:
-                nums.append(next)
-            else:
-                nums.append(to_binary(next))
-            num = next
-        return nums
+            model = self.rhythm_model(instrument, order)
+            with profiling.stage('sample', self.name, num_of_samples):
+                nums = model.sample(num_of_samples + 1, random_state=random_state)
+        if int_output:
+            return nums.tolist()
+        return rhythm.to_binary(nums, self.pulse_units)
+
+    # Generates random sequences of cycles for two instruments which play together
+    # A sequence for given is generated first, and then a sequence for instrument conditioned on it (see rhythm_model)
+    # Returns both sequences, in the same format as rhythm_sequence, drawing them from random_state as rhythm_sequence does
+    def joint_rhythm_sequence(self, instrument, given, num_of_samples, int_output=False, order=1, random_state=np.random):
+        given_nums = self.rhythm_model(given, order).sample(num_of_samples + 1, random_state=random_state)
+        nums = self.rhythm_model(instrument, order, given).sample(num_of_samples + 1, given_nums, random_state=random_state)
+        if int_output:
+            return given_nums.tolist(), nums.tolist()
+        return rhythm.to_binary(given_nums, self.pulse_units), rhythm.to_binary(nums, self.pulse_units)
 
     # Performs a one-sample t-test on a given metric location to determine if there is significant micro-timing in the data
     # Tests if the sample mean is significantly different from the population mean of 0
-    # Plots a histogram for each piece in the dataset, and prints their p-values, means, and if it was significant or not
-    def statistical_test(self, test_metric_location, significance=0.05, filter=''):
-        dfs = self.df_list
-        dfs_new = []
-        file_paths = list(self._get_paths(filter))
-        i = 0
-
-        for df in dfs:
-            piece_name = file_paths[i].stem
-            df['Piece'] = piece_name
-            df_filtered = df[(df['Metric_location'] == test_metric_location) & (df['Phase'] < test_metric_location + 1)]
-            offsets_filtered = df_filtered['Offset']
-
+    # Plots a histogram for each take in the dataset, and returns a table of their p-values, means, and if it was significant or not
+    # Can be restricted to a take and instrument (see select), or to any files with a given string in them
+    def statistical_test(self, test_metric_location, significance=0.05, filter='', take=None, instrument=None):
+        df = self.select(take, instrument, metric_location=test_metric_location)
+        if filter:
+            df = df[df['File'].str.contains(filter, regex=False)]
+        df_filtered = df[df[self.phase] < test_metric_location + 1]
+
+        rows = []
+        for piece_name, take in df_filtered.groupby('File', sort=False, observed=True):
             # one-sample t-test
-            _, p_value = ttest_1samp(offsets_filtered, popmean=0)
-            sample_mean = offsets_filtered.mean()
-
-            df['p_value'] = p_value
-            df_filtered = df[(df['Metric_location'] == test_metric_location) & (df['Phase'] < test_metric_location + 1)]
-
-            dfs_new.append(df_filtered)
-            print(f'{i} - {piece_name}: p={p_value}, mean={sample_mean}, significant={p_value < significance}')
-            i += 1
-            
-        df_all = pd.concat(dfs_new)
-        df_all.hist('Offset', by='Piece', bins=10, density=True, stacked=True)
-        plt.show()
+            _, p_value = ttest_1samp(take['Offset'], popmean=0)
+            rows.append([piece_name, p_value, take['Offset'].mean(), p_value < significance])
+
+        if len(df_filtered):
+            df_filtered.hist('Offset', by='File', bins=10, density=True, stacked=True)
+            plt.show()
+        return pd.DataFrame(rows, columns=['Piece', 'p_value', 'Mean', 'Significant'])
+
+    # Computes bootstrap confidence intervals for the mean offset at every metric location, optionally per group (e.g. by=['File'] for each take)
+    # Resamples are generated in chunks across a pool of processes (see resampling.bootstrap_ci), and are reproducible for a given seed
+    # Returns a table with the mean, lower and upper bounds of the confidence interval, and count for each group and metric location
+    def bootstrap(self, by=None, num_resamples=10000, confidence=0.95, seed=0, processes=None):
+        keys = list(by or []) + [self.metric_loc]
+        groups = [(key, group['Offset']) for key, group in self.df.groupby(keys, observed=True)]
+        intervals = resampling.bootstrap_ci([offsets for _, offsets in groups], num_resamples, confidence, seed, processes=processes)
+        table = pd.DataFrame([[*key, *interval, len(offsets)] for (key, offsets), interval in zip(groups, intervals)],
+                             columns=keys + ['Mean', 'CI lower', 'CI upper', 'Count'])
+        return self._add_location_indices(table, len(keys) - 1)
+
+    # Performs permutation tests of the difference in mean offset between every pair of groups (e.g. takes) at every metric location
+    # by is the column identifying the groups, and groups is an optional list of the groups to compare (default all of them)
+    # Returns a table with the observed difference in means (first minus second group) and its two-sided p-value for each pair and metric location
+    def permutation_test(self, by='File', groups=None, num_resamples=10000, seed=0, processes=None):
+        df = self.df if groups is None else self.df[self.df[by].isin(groups)]
+        rows = []
+        pairs = []
+        for location, at_location in df.groupby(self.metric_loc):
+            offsets = {group: values.to_numpy() for group, values in at_location.groupby(by, sort=False, observed=True)['Offset']}
+            names = list(offsets)
+            for i in range(len(names)):
+                for j in range(i + 1, len(names)):
+                    rows.append([names[i], names[j], location])
+                    pairs.append((offsets[names[i]], offsets[names[j]]))
+        results = resampling.permutation_test(pairs, num_resamples, seed, processes=processes)
+        table = pd.DataFrame([row + list(result) for row, result in zip(rows, results)],
+                             columns=[f'{by} 1', f'{by} 2', self.metric_loc, 'Difference', 'p_value'])
+        return self._add_location_indices(table, 2)
+
+# Computes the tempo curve of one take from an array of its beat onset times, against percentage progress through the take rounded to resolution
+# Returns the progress values, the tempo at each, the tempo averaged over a sliding window of window progress values, and the take's duration
+# Defined at module level so that it can be run in worker processes
+def _tempo_curve(onsets, resolution, window):
+    # The tempo of each beat is measured from the beat before it, so the first beat has none
+    tempo = np.concatenate([[np.nan], 60 / np.diff(onsets)])
+    duration = onsets[-1] - onsets[0]
+    # Percentage progress throughout the piece, rounded to the resolution
+    progress = ((onsets - onsets[0]) / duration) * 100
+    progress = np.round(np.rint(progress / resolution) * resolution, 10)
+    # Beats which round to the same progress are averaged
+    grid, bins = np.unique(progress, return_inverse=True)
+    measured = ~np.isnan(tempo)
+    with np.errstate(invalid='ignore'):
+        tempo = np.bincount(bins, np.where(measured, tempo, 0), len(grid)) / np.bincount(bins, measured, len(grid))
+    average_tempo = pd.Series(tempo).rolling(window=window).mean().to_numpy()
+    return grid, tempo, average_tempo, duration
+
+# Private function which calculates the phase of every onset in a concatenation of takes of a piece with the given number of beats per cycle,
+# where lengths is the number of onsets in each take. If drop is True, incomplete cycles at the end of each take are removed (apart from their first onset)
+# If snap_window is given, a gap in a take of about two or more beats at the local tempo (the median of the snap_window inter-onset intervals
+# around it) is treated as missing beats, which are filled with evenly spaced onsets so that later onsets keep their metric locations
+# Returns arrays of the take, row within the take, cycle number, metric location and offset of each onset with a phase, in order
+def _onset_phases(onsets, lengths, beats, beat_division, drop=True, snap_window=None):
+    takes = np.repeat(np.arange(len(lengths)), lengths)
+    rows = np.arange(len(onsets)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    is_onset = np.ones(len(onsets), dtype=bool)
+
+    if snap_window:
+        # Interval from each onset to the next in the same take
+        intervals = np.append(np.diff(onsets), np.nan)
+        intervals[rows == np.repeat(lengths, lengths) - 1] = np.nan
+        half = snap_window // 2
+        windows = sliding_window_view(np.pad(intervals, half, constant_values=np.nan), 2 * half + 1)
+        window_takes = sliding_window_view(np.pad(takes, half, constant_values=-1), 2 * half + 1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            local_interval = np.nanmedian(np.where(window_takes == takes[:, None], windows, np.nan), axis=1)
+            steps = np.rint(intervals / local_interval)
+        steps = np.where(steps >= 2, steps, 1).astype(np.int64)
+
+        # Spread each onset's interval over its steps, filling the missing beats in between
+        owner = np.repeat(np.arange(len(onsets)), steps)
+        step = np.arange(len(owner)) - np.repeat(np.cumsum(steps) - steps, steps)
+        onsets = onsets[owner] + step * np.nan_to_num(intervals / steps)[owner]
+        is_onset = step == 0
+        rows = rows[owner]
+        takes = takes[owner]
+        lengths = np.bincount(takes, minlength=len(lengths))
+
+    position = np.arange(len(onsets)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    metric_location = position % beats
+    available = np.repeat(lengths - (lengths - 1) % beats if drop else lengths, lengths)
+
+    # Onsets in the last cycle of a take have no following downbeat, so only its first onset (which has an offset of 0 by definition) is kept
+    cycle_start_index = np.arange(len(onsets)) - metric_location
+    has_end = position - metric_location + beats < available
+    cycle_start_onset = onsets[cycle_start_index]
+    cycle_end_onset = onsets[np.where(has_end, cycle_start_index + beats, cycle_start_index)]
+    isochronous_beat_duration = (cycle_end_onset - cycle_start_onset) / beats
+    with np.errstate(divide='ignore', invalid='ignore'):
+        isochronous_onset = cycle_start_onset + (metric_location * isochronous_beat_duration)
+        offset = ((onsets - isochronous_onset) / isochronous_beat_duration) * (beat_division / 2)
+    offset = np.where(has_end, offset, np.where(metric_location == 0, 0.0, np.nan))
+
+    kept = (position < available) & is_onset & ~np.isnan(offset)
+    return takes[kept], rows[kept], position[kept] // beats + 1, metric_location[kept], offset[kept]
+
+
+# rcParams for saving figures as .pgf files for LaTeX documents
+LATEX_RC_PARAMS = {
+    "pgf.texsystem": "pdflatex",
+    'font.family': 'serif',
+    'text.usetex': True,
+    'pgf.rcfonts': False,
+}
 
 def enable_latex_output():
     matplotlib.use("pgf")
-    matplotlib.rcParams.update({
-        "pgf.texsystem": "pdflatex",
-        'font.family': 'serif',
-        'text.usetex': True,
-        'pgf.rcfonts': False,
-    })
+    matplotlib.rcParams.update(LATEX_RC_PARAMS)
 
 def disable_latex_output():
     matplotlib.use('TkAgg')
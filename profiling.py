@@ -0,0 +1,134 @@
+import json
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+
+# Opt-in instrumentation of the stages of an analysis (reading files, filtering, grouping, fitting models and curves, rendering)
+# Stages are timed with "with profiling.stage('name', piece=...) as s:", optionally setting s.rows to the number of rows processed
+# While disabled, stage returns a shared object which does nothing, so instrumented code runs as before
+# Setting the PROFILE_LOG environment variable to a path enables profiling on import, e.g. in worker processes, appending records to it as JSON lines
+_enabled = False
+_memory = False
+_log_path = None
+_stack = []
+records = []
+
+COLUMNS = ['stage', 'parent', 'piece', 'seconds', 'rows', 'memory_delta', 'time', 'pid']
+
+
+class _NullStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    # Rows set on the shared null stage are ignored
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    def __init__(self, name, piece, rows):
+        self.name = name
+        self.piece = piece
+        self.rows = rows
+
+    def __enter__(self):
+        self.parent = _stack[-1].name if _stack else None
+        _stack.append(self)
+        if _memory:
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        _stack.pop()
+        record = {
+            'stage': self.name,
+            'parent': self.parent,
+            'piece': self.piece,
+            'seconds': seconds,
+            'rows': self.rows,
+            'memory_delta': tracemalloc.get_traced_memory()[0] - self.memory if _memory else None,
+            'time': time.time(),
+            'pid': os.getpid(),
+        }
+        records.append(record)
+        if _log_path is not None:
+            with open(_log_path, 'a') as file:
+                file.write(json.dumps(record, default=str) + '\n')
+        return False
+
+
+# Returns a context manager which records the wall time, rows processed and memory delta of a stage when profiling is enabled
+# piece is the name of the piece being analysed, and rows can also be set on the returned object inside the with block
+def stage(name, piece=None, rows=None):
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, piece, rows)
+
+
+# Starts recording stages, appending each record to log_path as a JSON line if it is given
+# If memory is True, memory deltas are measured with tracemalloc, which slows down allocation-heavy code
+def enable(log_path=None, memory=True):
+    global _enabled, _memory, _log_path
+    _enabled = True
+    _memory = memory
+    _log_path = log_path
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# Stops recording stages
+def disable():
+    global _enabled, _memory, _log_path
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _memory = False
+    _log_path = None
+
+
+def enabled():
+    return _enabled
+
+
+# Returns the records so far as a dataframe with one row per stage, in the order they finished
+# If log_path is given, the records are read from that JSON-lines log instead, which includes those from other processes
+def report(log_path=None):
+    if log_path is not None:
+        with open(log_path) as file:
+            return pd.DataFrame([json.loads(line) for line in file if line.strip()], columns=COLUMNS)
+    return pd.DataFrame(records, columns=COLUMNS)
+
+
+# Returns the total time, count and rows of each stage (optionally for each piece too), slowest first
+# log_path is as in report
+def summary(by_piece=False, log_path=None):
+    keys = ['piece', 'stage'] if by_piece else ['stage']
+    df = report(log_path)
+    if df.empty:
+        return pd.DataFrame(columns=keys + ['count', 'seconds', 'rows', 'memory_delta'])
+    return (df.groupby(keys, dropna=False)
+              .agg(count=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', 'sum'), memory_delta=('memory_delta', 'sum'))
+              .sort_values('seconds', ascending=False)
+              .reset_index())
+
+
+def clear():
+    records.clear()
+
+
+if os.environ.get('PROFILE_LOG'):
+    enable(os.environ['PROFILE_LOG'])
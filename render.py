@@ -0,0 +1,62 @@
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+
+from piece import LATEX_RC_PARAMS
+
+
+# Headless batch rendering of figures for many pieces
+# Each figure is drawn in a worker process with the non-interactive Agg backend and its own rcParams, so no global backend switching is needed
+# A manifest in the output directory records a hash of the data and arguments behind each figure, and figures whose hash is unchanged are not drawn again
+MANIFEST = '.render-manifest.json'
+
+
+def _init_worker():
+    matplotlib.use('Agg')
+
+
+# Private function which draws and saves one figure in a worker process, unless previous_key matches its current key and the file exists
+# Returns the figure's path, its key, and whether it was drawn
+def _render(piece, method, kwargs, save_format, output_dir, rc_params, previous_key):
+    import matplotlib.pyplot as plt
+
+    path = piece.figure_path(method, save_format, output_dir)
+    digest = hashlib.sha256(piece.data_hash().encode())
+    digest.update(json.dumps([method, kwargs, save_format, rc_params], sort_keys=True, default=str).encode())
+    key = digest.hexdigest()
+    if key == previous_key and path.exists():
+        return str(path), key, False
+
+    with matplotlib.rc_context(rc_params):
+        # Each figure already has a worker of its own, so its fits run serially rather than starting another pool
+        getattr(piece, method)(**kwargs, save_format=save_format, output_dir=output_dir, show=False, processes=1)
+    plt.close('all')
+    return str(path), key, True
+
+
+# Renders a list of figures in parallel worker processes (all cores if processes is None), skipping those whose data and arguments are unchanged
+# Each job is a tuple (piece, method, kwargs), where method is 'plot_histogram' or 'tempo' and kwargs are its arguments, e.g. (suku, 'tempo', {'beat_instrument': 'Jembe-2', 'tempo_cutoff': 95})
+# Figures are saved to output_dir in save_format, using the LaTeX rcParams if latex is True (or any other rcParams in rc_params)
+# Returns a list of the paths of the figures which were drawn
+def render(jobs, save_format='.png', output_dir='figures', latex=False, rc_params=None, processes=None):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    rc_params = {**(LATEX_RC_PARAMS if latex else {}), **(rc_params or {})}
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker) as executor:
+        futures = [executor.submit(_render, piece, method, kwargs, save_format, output_dir, rc_params, manifest.get(str(piece.figure_path(method, save_format, output_dir))))
+                   for piece, method, kwargs in jobs]
+        results = [future.result() for future in futures]
+
+    rendered = []
+    for path, key, drawn in results:
+        manifest[path] = key
+        if drawn:
+            rendered.append(path)
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return rendered
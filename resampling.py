@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Resampling-based significance tests for offsets
+# Resamples are generated as one NumPy array per chunk, and chunks are spread over a pool of processes
+# Every chunk has its own random generator spawned from a single seed, so results are reproducible whatever the number of processes
+
+
+# Private function which returns the means of size bootstrap resamples of values
+def _bootstrap_chunk(values, size, seed):
+    rng = np.random.default_rng(seed)
+    return values[rng.integers(0, len(values), (size, len(values)))].mean(axis=1)
+
+
+# Private function which returns the differences in means between the first n_a values and the rest, for size random permutations of pooled
+def _permutation_chunk(pooled, n_a, size, seed):
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.broadcast_to(pooled, (size, len(pooled))), axis=1)
+    return permuted[:, :n_a].mean(axis=1) - permuted[:, n_a:].mean(axis=1)
+
+
+# Private function which runs chunk_function on every job, where each job is a tuple of arguments followed by a number of resamples,
+# splitting the resamples into chunks and returning the concatenated results of each job
+def _run_chunked(chunk_function, jobs, num_resamples, chunk_size, seed, processes):
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(jobs) * -(-num_resamples // chunk_size)))
+    chunks = []
+    for i, args in enumerate(jobs):
+        for start in range(0, num_resamples, chunk_size):
+            chunks.append((i, args + (min(chunk_size, num_resamples - start), next(seeds))))
+
+    if len(chunks) > 1 and processes != 1:
+        with ProcessPoolExecutor(processes) as executor:
+            futures = [executor.submit(chunk_function, *args) for _, args in chunks]
+            results = [future.result() for future in futures]
+    else:
+        results = [chunk_function(*args) for _, args in chunks]
+
+    outputs = [[] for _ in jobs]
+    for (i, _), result in zip(chunks, results):
+        outputs[i].append(result)
+    return [np.concatenate(output) for output in outputs]
+
+
+# Computes percentile bootstrap confidence intervals for the mean of each array in samples
+# Returns a list of (mean, lower bound, upper bound) tuples in the same order
+def bootstrap_ci(samples, num_resamples=10000, confidence=0.95, seed=0, chunk_size=1000, processes=None):
+    samples = [np.asarray(values, dtype=np.float64) for values in samples]
+    means = _run_chunked(_bootstrap_chunk, [(values,) for values in samples], num_resamples, chunk_size, seed, processes)
+    alpha = (1 - confidence) / 2
+    return [(values.mean(), *np.quantile(resampled, [alpha, 1 - alpha])) for values, resampled in zip(samples, means)]
+
+
+# Performs a two-sided permutation test of the difference in means for each pair of arrays (a, b) in pairs
+# Returns a list of (observed difference in means, p-value) tuples in the same order
+def permutation_test(pairs, num_resamples=10000, seed=0, chunk_size=1000, processes=None):
+    pairs = [(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)) for a, b in pairs]
+    jobs = [(np.concatenate([a, b]), len(a)) for a, b in pairs]
+    differences = _run_chunked(_permutation_chunk, jobs, num_resamples, chunk_size, seed, processes)
+    results = []
+    for (a, b), resampled in zip(pairs, differences):
+        observed = a.mean() - b.mean()
+        # Add one to count the observed arrangement, so the p-value is never 0
+        p_value = (np.sum(np.abs(resampled) >= np.abs(observed)) + 1) / (len(resampled) + 1)
+        results.append((observed, p_value))
+    return results
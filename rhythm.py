@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+
+
+# Encodes the rhythm pattern of every cycle as an integer, whose binary expansion (most significant bit first) has a 1 for each pulse unit with an onset
+# takes, cycles and locs are arrays giving the take, cycle number, and metric location index (1 to pulse_units) of each onset
+# Returns a series of patterns indexed by take and cycle, in order of first appearance
+def encode_cycles(takes, cycles, locs, pulse_units):
+    locs = np.asarray(locs, dtype=np.int64)
+    codes, uniques = pd.MultiIndex.from_arrays([takes, cycles], names=['Take', 'Cycle']).factorize()
+    patterns = np.zeros(len(uniques), dtype=np.int64)
+    np.bitwise_or.at(patterns, codes, np.left_shift(1, pulse_units - locs))
+    return pd.Series(patterns, index=uniques, name='Pattern')
+
+
+# Returns a boolean array which is True for the first cycle of each take in a series of patterns returned by encode_cycles
+def first_cycles(patterns):
+    takes = patterns.index.get_level_values(0)
+    is_first = np.ones(len(patterns), dtype=bool)
+    is_first[1:] = takes[1:] != takes[:-1]
+    return is_first
+
+
+# Converts an array of patterns into a list of lists of 1s and 0s, one per pulse unit
+def to_binary(patterns, pulse_units):
+    shifts = np.arange(pulse_units - 1, -1, -1)
+    return ((np.asarray(patterns)[:, None] >> shifts) & 1).tolist()
+
+
+# Private function which builds alias tables (Vose's method) for sampling from each row of a sparse matrix of counts in O(1)
+# Returns the threshold probabilities and alias positions for every stored entry, laid out like the matrix's data array
+def _alias_tables(matrix):
+    prob = np.zeros(len(matrix.data))
+    alias = np.zeros(len(matrix.data), dtype=np.int64)
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        n = end - start
+        if n == 0:
+            continue
+        scaled = matrix.data[start:end] * n / matrix.data[start:end].sum()
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[start + s] = scaled[s]
+            alias[start + s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        for i in small + large:
+            prob[start + i] = 1
+    return prob, alias
+
+
+# Table of transition counts from a set of contexts to a set of states, stored as a sparse matrix over only the observed pairs
+# Precomputed alias tables make drawing the next state for a context O(1)
+class _TransitionTable:
+
+    def __init__(self, contexts, states, shape):
+        counts = coo_matrix((np.ones(len(contexts)), (contexts, states)), shape=shape)
+        self.matrix = counts.tocsr()
+        self.matrix.sum_duplicates()
+        self._prob, self._alias = _alias_tables(self.matrix)
+
+    # Draws the next state for context using uniform random numbers r1 and r2, or returns -1 if context was never followed by a state
+    def draw(self, context, r1, r2):
+        start, end = self.matrix.indptr[context], self.matrix.indptr[context + 1]
+        if start == end:
+            return -1
+        i = start + int(r1 * (end - start))
+        if r2 >= self._prob[i]:
+            i = start + self._alias[i]
+        return self.matrix.indices[i]
+
+
+# First-order Markov chain over cycle patterns
+# Transitions are counted in a sparse matrix over the observed states, and precomputed alias tables make each sampling step O(1)
+class MarkovChain:
+
+    # patterns is the sequence of observed states, and is_first marks the states which start a sequence
+    def __init__(self, patterns, is_first):
+        patterns = np.asarray(patterns)
+        self.states, indices = np.unique(patterns, return_inverse=True)
+        # Transitions are counted across the whole sequence, including from the end of one take to the start of the next
+        self.transitions = _TransitionTable(indices[:-1], indices[1:], (len(self.states), len(self.states)))
+        self.starts = indices[np.asarray(is_first)]
+
+    # Private method that draws the next state index after state, using uniform random numbers r1 and r2
+    # States which were never followed by another state restart from a random starting state
+    def _step(self, state, r1, r2):
+        next_state = self.transitions.draw(state, r1, r2)
+        if next_state < 0:
+            return self.starts[int(r1 * len(self.starts))]
+        return next_state
+
+    # Generates a random sequence of num_of_samples states following a random starting state
+    # random_state is a numpy RandomState (defaults to the global one, so np.random.seed makes sequences reproducible)
+    def sample(self, num_of_samples, random_state=np.random):
+        r = random_state.random_sample((num_of_samples + 1, 2))
+        state = self.starts[int(r[0, 0] * len(self.starts))]
+        sequence = np.empty(num_of_samples + 1, dtype=np.int64)
+        sequence[0] = state
+        for i in range(1, num_of_samples + 1):
+            state = self._step(state, r[i, 0], r[i, 1])
+            sequence[i] = state
+        return self.states[sequence]
+
+
+# Markov model over cycle patterns with a context of the previous order cycles, and optionally the concurrent cycle of another instrument
+# Contexts are stored as a trie of integer ids, one level per context element, so memory grows with the number of observed contexts rather than exponentially with order
+# When sampling, unseen contexts back off to the longest observed suffix (dropping the oldest cycles first), and finally to the unconditional distribution
+class ContextModel:
+
+    # sequences is a list of arrays of patterns, one per take
+    # If conditions is given, it is a list of arrays of the other instrument's patterns, aligned cycle by cycle with sequences
+    def __init__(self, sequences, order=2, conditions=None):
+        self.order = order
+        self.conditional = conditions is not None
+        lengths = [len(sequence) for sequence in sequences]
+        self.states, targets = np.unique(np.concatenate(sequences), return_inverse=True)
+        # Index len(states) pads the context before the start of each take, so the opening cycles are modelled too
+        pad = len(self.states)
+
+        take_starts = np.repeat(np.cumsum([0] + lengths[:-1]), lengths)
+        position = np.arange(len(targets)) - take_starts
+        columns = []
+        vocab_sizes = []
+        if self.conditional:
+            self.condition_states, condition_indices = np.unique(np.concatenate(conditions), return_inverse=True)
+            columns.append(condition_indices)
+            vocab_sizes.append(len(self.condition_states))
+        for lag in range(1, order + 1):
+            previous = np.full(len(targets), pad)
+            shifted = np.arange(len(targets)) - lag
+            has_previous = position >= lag
+            previous[has_previous] = targets[shifted[has_previous]]
+            columns.append(previous)
+            vocab_sizes.append(pad + 1)
+        self._vocab_sizes = vocab_sizes
+
+        # Level 0 is the empty context, and level j extends each context at level j-1 by columns[j-1]
+        ids = np.zeros(len(targets), dtype=np.int64)
+        self._keys = [np.zeros(1, dtype=np.int64)]
+        self._tables = [_TransitionTable(ids, targets, (1, len(self.states)))]
+        for column, vocab_size in zip(columns, vocab_sizes):
+            keys = ids * vocab_size + column
+            self._keys.append(np.unique(keys))
+            ids = np.searchsorted(self._keys[-1], keys)
+            self._tables.append(_TransitionTable(ids, targets, (len(self._keys[-1]), len(self.states))))
+
+    # Private method that returns the context id at each level for the given context values, stopping at the first unseen context
+    def _context_ids(self, values):
+        ids = [0]
+        for keys, value, vocab_size in zip(self._keys[1:], values, self._vocab_sizes):
+            key = ids[-1] * vocab_size + value
+            i = np.searchsorted(keys, key)
+            if i == len(keys) or keys[i] != key:
+                break
+            ids.append(i)
+        return ids
+
+    # Generates a random sequence of num_of_samples patterns, starting from the beginning of a take
+    # For a conditional model, conditions is the sequence of the other instrument's patterns to condition on, and must have at least num_of_samples entries
+    # random_state is a numpy RandomState (defaults to the global one, so np.random.seed makes sequences reproducible)
+    def sample(self, num_of_samples, conditions=None, random_state=np.random):
+        pad = len(self.states)
+        if self.conditional:
+            # Conditioning patterns never seen in training are mapped to an index with no observed contexts, so they back off
+            condition_indices = np.searchsorted(self.condition_states, conditions[:num_of_samples])
+            unseen = (condition_indices == len(self.condition_states)) | (self.condition_states[np.minimum(condition_indices, len(self.condition_states) - 1)] != conditions[:num_of_samples])
+            condition_indices[unseen] = len(self.condition_states)
+        r = random_state.random_sample((num_of_samples, 2))
+        history = [pad] * self.order
+        sequence = np.empty(num_of_samples, dtype=np.int64)
+        for t in range(num_of_samples):
+            values = ([condition_indices[t]] if self.conditional else []) + history[::-1]
+            ids = self._context_ids(values)
+            # Every observed context has at least one transition, so the deepest one can always be drawn from
+            state = self._tables[len(ids) - 1].draw(ids[-1], r[t, 0], r[t, 1])
+            sequence[t] = state
+            history = (history + [state])[1:]
+        return self.states[sequence]
@@ -0,0 +1,45 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+# Runs a dependency graph of tasks across a pool of processes (all cores if processes is None)
+# tasks is a dictionary mapping each task name to a tuple (function, args, dependencies), where dependencies is a list of task names
+# A task is started as soon as all of its dependencies have finished, and its function must be picklable (i.e. defined at module level)
+# If a task raises an exception, tasks which depend on it are skipped and the exception is stored as its result
+# Returns a dictionary mapping each task name to the value its function returned
+def run(tasks, processes=None, initializer=None):
+    for name, (_, _, dependencies) in tasks.items():
+        for dependency in dependencies:
+            if dependency not in tasks:
+                raise ValueError(f'Task {name} depends on unknown task {dependency}')
+
+    results = {}
+    remaining = dict(tasks)
+    running = {}
+    with ProcessPoolExecutor(processes, initializer=initializer) as executor:
+        while remaining or running:
+            # Skipping a task can make its dependents skippable too, so repeat until nothing changes
+            changed = True
+            while changed:
+                changed = False
+                for name, (function, args, dependencies) in list(remaining.items()):
+                    failed = [d for d in dependencies if isinstance(results.get(d), Exception)]
+                    if failed:
+                        results[name] = RuntimeError(f'Skipped because {failed[0]} failed')
+                    elif all(d in results for d in dependencies):
+                        running[executor.submit(function, *args)] = name
+                    else:
+                        continue
+                    del remaining[name]
+                    changed = True
+            if not running:
+                if remaining:
+                    raise ValueError(f'Tasks {sorted(remaining)} have circular dependencies')
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as exception:
+                    results[name] = exception
+    return results
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from summary import Summary
+
+
+# Incremental version of Piece.load_from_onsets for live onset data, e.g. from a beat tracker during a performance
+# Onsets of every beat are pushed one at a time or in chunks, and the phase and offset of each beat in a cycle are emitted as soon as
+# the first onset of the following cycle arrives. Only the onsets of the current cycle are kept, so memory use is constant
+# Running statistics of the offsets at each metric location are kept in summary (see summary.Summary), which is updated with each completed cycle
+class OnsetStream:
+
+    # beats and beat_division are as in Piece, and onset is the name of the onset column in the emitted dataframes
+    def __init__(self, beats, beat_division, onset='Onset'):
+        self.beats = beats
+        self.beat_division = beat_division
+        self.onset = onset
+        self.cycles = 0
+        self._pending = np.empty(0)
+        self.summary = Summary(0, np.zeros(beats), np.zeros(beats))
+
+    # Adds a single onset time, returning a dataframe of the beats in the cycle it completes (which is empty if it does not complete one)
+    def push(self, onset):
+        return self.extend([onset])
+
+    # Adds a chunk of onset times in order, returning a dataframe of the beats in all cycles they complete
+    def extend(self, onsets):
+        buffer = np.concatenate([self._pending, np.asarray(onsets, dtype=np.float64)])
+        # A cycle is complete once the onset after its last beat has arrived
+        complete = max(0, (len(buffer) - 1) // self.beats)
+        self._pending = buffer[complete * self.beats:]
+        if complete == 0:
+            return self._frame(np.empty((0, self.beats)), np.empty((0, self.beats)))
+
+        cycle_onsets = buffer[:complete * self.beats].reshape(complete, self.beats)
+        cycle_start_onset = cycle_onsets[:, 0]
+        cycle_end_onset = buffer[self.beats:(complete + 1) * self.beats:self.beats]
+        isochronous_beat_duration = (cycle_end_onset - cycle_start_onset) / self.beats
+        isochronous_onset = cycle_start_onset[:, None] + np.arange(self.beats) * isochronous_beat_duration[:, None]
+        offset = ((cycle_onsets - isochronous_onset) / isochronous_beat_duration[:, None]) * (self.beat_division / 2)
+        self.summary = self.summary.merge(Summary.of(offset))
+        return self._frame(cycle_onsets, offset)
+
+    # Private method that builds the emitted dataframe for arrays of onsets and offsets with one row per cycle
+    def _frame(self, cycle_onsets, offset):
+        complete = len(cycle_onsets)
+        first_cycle = self.cycles + 1
+        self.cycles += complete
+        metric_location = np.tile(np.arange(self.beats), complete)
+        return pd.DataFrame({
+            self.onset: cycle_onsets.ravel(),
+            'Cycle_number': np.repeat(np.arange(first_cycle, first_cycle + complete), self.beats),
+            'Metric_location': metric_location,
+            'Offset': offset.ravel(),
+            'Phase': offset.ravel() + metric_location,
+            'Is_included_in_grid': 1,
+        })
+
+    # Returns the count, mean and standard deviation of the offsets so far at each metric location
+    def stats(self):
+        return pd.DataFrame({
+            'Metric_location': np.arange(self.beats),
+            'Count': self.summary.count,
+            'Mean': self.summary.mean if self.summary.count else np.full(self.beats, np.nan),
+            'Standard deviation': self.summary.stddev(),
+        })
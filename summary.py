@@ -0,0 +1,63 @@
+import numpy as np
+
+
+# Compact, mergeable summary of a set of values: their count, mean, and sum of squared deviations from the mean
+# Summaries can be updated one value at a time in O(1) (Welford's algorithm), and summaries of different sets of values,
+# e.g. computed on different takes or machines, can be merged into the summary of their union (Chan et al.'s parallel algorithm)
+# The fields may also be numpy arrays, to summarize several metric locations at once
+class Summary:
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    # Returns the summary of an array of values, or of each column of a 2D array
+    @classmethod
+    def of(cls, values, axis=0):
+        values = np.asarray(values, dtype=np.float64)
+        mean = values.mean(axis=axis)
+        return cls(values.shape[axis], mean, ((values - mean) ** 2).sum(axis=axis))
+
+    # Adds a single value (or one value per metric location) to the summary
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+        return self
+
+    # Returns the summary of the values in both this summary and other
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return Summary()
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        return Summary(count, mean, m2)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    # Sample standard deviation, as calculated by pandas (NaN for fewer than two values)
+    def stddev(self):
+        if self.count < 2:
+            return self.mean * np.nan
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    # Returns the fields as a tuple, e.g. for sending to another process or storing
+    def to_tuple(self):
+        return (self.count, self.mean, self.m2)
+
+    def __repr__(self):
+        return f'Summary(count={self.count}, mean={self.mean}, m2={self.m2})'
+
+
+# Merges dictionaries of summaries (e.g. one per take or per worker), returning a dictionary with the merged summary for each key
+def merge_all(summaries_list):
+    merged = {}
+    for summaries in summaries_list:
+        for key, summary in summaries.items():
+            merged[key] = merged[key] + summary if key in merged else summary
+    return merged
@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.optimize import curve_fit
+
+
+# Fitting of the tempo model used by Piece.tempo: y = a log(x+b) + c for x < cutoff, and y = dx^2 + ex + f for x >= cutoff
+# The two segments share no parameters, so for a given cutoff the quadratic segment is solved exactly by linear least squares,
+# and the logarithmic segment is linear in a and c for a given b. The cutoff and b are chosen together in one vectorized sweep
+# over candidate cutoffs and a grid of b values, using cumulative sums so that every candidate costs O(1),
+# and the logarithmic segment is then refined with curve_fit using its analytic Jacobian
+
+# Offsets of x + b from 0 at its smallest x, as multiples of the range of x, tried for b in the sweep
+B_GRID = np.logspace(-4, 2, 49)
+
+# Fewest points allowed in each segment
+MIN_POINTS = 5
+
+# Most evaluations of the logarithmic segment allowed when refining its fit
+MAX_EVALUATIONS = 50
+
+
+# Evaluates the tempo model at x
+def combined(x, cutoff, a, b, c, d, e, f):
+    with np.errstate(invalid='ignore'):
+        return np.where(x < cutoff, a * np.log(x + b) + c, (d * (x**2)) + (e * x) + f)
+
+
+def _log_model(x, a, b, c):
+    return a * np.log(x + b) + c
+
+
+# Private function which returns the Jacobian of _log_model with respect to a, b and c
+def _log_jacobian(x, a, b, c):
+    return np.column_stack([np.log(x + b), a / (x + b), np.ones_like(x)])
+
+
+# Private function which returns the residual sum of squares of the best fit of a line to y against each row of features,
+# using only the first k points for each k in splits, as an array of shape (rows, splits)
+def _line_rss(features, y, splits):
+    count = splits.astype(np.float64)
+    sum_f = np.cumsum(features, axis=1)[:, splits - 1]
+    sum_ff = np.cumsum(features**2, axis=1)[:, splits - 1]
+    sum_fy = np.cumsum(features * y, axis=1)[:, splits - 1]
+    sum_y = np.cumsum(y)[splits - 1]
+    sum_yy = np.cumsum(y**2)[splits - 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (count * sum_fy - sum_f * sum_y) / (count * sum_ff - sum_f**2)
+        intercept = (sum_y - slope * sum_f) / count
+    return sum_yy - slope * sum_fy - intercept * sum_y
+
+
+# Private function which returns the residual sum of squares of the best quadratic fit to y against x using only the points from k onwards,
+# for each k in splits
+def _quadratic_rss(x, y, splits):
+    # Sums from the end, so that entry k covers the points from k onwards
+    def suffix(values):
+        return np.cumsum(values[..., ::-1], axis=-1)[..., ::-1][..., splits]
+
+    powers = suffix(np.vstack([x**p for p in range(5)]))
+    moments = suffix(np.vstack([y * x**p for p in range(3)]))
+    normal = np.stack([powers[i:i + 3] for i in range(3)]).transpose(2, 0, 1)
+    with np.errstate(invalid='ignore'):
+        coefficients = np.linalg.solve(normal, moments.T[:, :, None])[:, :, 0]
+    return suffix(y**2) - np.sum(coefficients * moments.T, axis=1)
+
+
+# Returns the cutoff and value of b which minimise the total residual sum of squares of the tempo model for x and y (sorted by x),
+# trying a cutoff at each value of x between min_cutoff and max_cutoff, and every b in B_GRID
+def search(x, y, min_cutoff=None, max_cutoff=None):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    splits = np.arange(MIN_POINTS, len(x) - MIN_POINTS + 1)
+    if min_cutoff is not None:
+        splits = splits[x[splits] >= min_cutoff]
+    if max_cutoff is not None:
+        splits = splits[x[splits] <= max_cutoff]
+    if len(splits) == 0:
+        raise ValueError('Too few points to fit the tempo model')
+
+    # Centre and scale x and y so the sums are well conditioned
+    span = x[-1] - x[0]
+    t = (x - x[0]) / span
+    centred = y - y.mean()
+    b_values = B_GRID - t[0]
+    log_rss = _line_rss(np.log(t[None, :] + B_GRID[:, None]), centred, splits)
+    total = np.nan_to_num(log_rss, nan=np.inf) + np.nan_to_num(_quadratic_rss(t, centred, splits), nan=np.inf)[None, :]
+    best_b, best_split = np.unravel_index(np.argmin(total), total.shape)
+    return x[splits[best_split]], b_values[best_b] * span - x[0]
+
+
+# Fits the tempo model to y against x, at the given cutoff or at the best cutoff found by search between min_cutoff and max_cutoff if cutoff is None
+# Returns the parameters a-f, their covariance (as calculated by curve_fit for the whole model), the residuals and the cutoff
+# If the fit fails (e.g. there are too few points on either side of the cutoff), the parameters and covariance are NaN
+def fit(x, y, cutoff=None, min_cutoff=None, max_cutoff=None):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    try:
+        if cutoff is None:
+            cutoff, b = search(x, y, min_cutoff, max_cutoff)
+        else:
+            below = x < cutoff
+            if below.sum() < 3 or (~below).sum() < 3:
+                raise ValueError('Too few points to fit the tempo model')
+            # Start b from the grid of the sweep at this cutoff
+            split = np.array([below.sum()])
+            t = (x - x[0]) / (x[-1] - x[0])
+            log_rss = _line_rss(np.log(t[None, :] + B_GRID[:, None]), y - y.mean(), split)[:, 0]
+            b = (B_GRID[np.nanargmin(log_rss)] - t[0]) * (x[-1] - x[0]) - x[0]
+
+        below = x < cutoff
+        x_log, y_log = x[below], y[below]
+        x_quadratic, y_quadratic = x[~below], y[~below]
+
+        # For a fixed b, a and c are a linear least squares solution, which is refined together with b
+        # If the refinement does not converge (e.g. the best fit is almost a straight line, with b tending to infinity), the solution at the starting b is kept
+        features = np.column_stack([np.log(x_log + b), np.ones_like(x_log)])
+        (a, c), *_ = np.linalg.lstsq(features, y_log, rcond=None)
+        lower = -x_log.min() + 1e-9 * (x[-1] - x[0])
+        try:
+            (a, b, c), _ = curve_fit(_log_model, x_log, y_log, p0=[a, max(b, lower), c], jac=_log_jacobian,
+                                     bounds=([-np.inf, lower, -np.inf], [np.inf, np.inf, np.inf]), max_nfev=MAX_EVALUATIONS)
+        except RuntimeError:
+            pass
+
+        quadratic = np.column_stack([x_quadratic**2, x_quadratic, np.ones_like(x_quadratic)])
+        (d, e, f), *_ = np.linalg.lstsq(quadratic, y_quadratic, rcond=None)
+    except (ValueError, RuntimeError, np.linalg.LinAlgError):
+        popt = np.full(6, np.nan)
+        return popt, np.full((6, 6), np.nan), y - np.nan, np.nan if cutoff is None else cutoff
+
+    popt = np.array([a, b, c, d, e, f])
+    residuals = y - combined(x, cutoff, *popt)
+
+    # The segments share no parameters, so J^T J is block diagonal; scale its inverse by the residual variance as curve_fit does
+    variance = np.sum(residuals**2) / (len(x) - 6) if len(x) > 6 else np.inf
+    log_jacobian = _log_jacobian(x_log, a, b, c)
+    pcov = np.zeros((6, 6))
+    pcov[:3, :3] = np.linalg.pinv(log_jacobian.T @ log_jacobian)
+    pcov[3:, 3:] = np.linalg.pinv(quadratic.T @ quadratic)
+    pcov *= variance
+    return popt, pcov, residuals[np.argsort(order, kind='stable')], cutoff
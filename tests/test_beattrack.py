@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('librosa')
+pytest.importorskip('libfmp.c6')
+
+import beattrack
+
+FEATURE_RATE = 100
+
+
+# Returns a novelty function of impulses at every beat of a steady tempo, optionally smoothed like a real novelty curve
+def impulse_train(bpm, seconds=60, smooth=False):
+    novelty_function = np.zeros(seconds * FEATURE_RATE)
+    novelty_function[np.round(np.arange(0, seconds, 60 / bpm) * FEATURE_RATE).astype(int)] = 1
+    if smooth:
+        novelty_function = np.convolve(novelty_function, np.exp(-0.5 * (np.arange(-5, 6) / 1.5) ** 2), mode='same')
+    return novelty_function
+
+
+# The waltz recordings are at about 182-200 BPM, whose multiples correlate as strongly as the beat period itself
+@pytest.mark.parametrize('bpm', [180, 182, 190, 196, 200])
+@pytest.mark.parametrize('smooth', [False, True])
+def test_fast_tempi_are_not_halved(bpm, smooth):
+    assert beattrack.estimate_tempo(impulse_train(bpm, smooth=smooth), FEATURE_RATE) == pytest.approx(bpm, rel=0.01)
+
+
+@pytest.mark.parametrize('bpm', [60, 90, 120, 150])
+def test_slower_tempi(bpm):
+    assert beattrack.estimate_tempo(impulse_train(bpm, smooth=True), FEATURE_RATE) == pytest.approx(bpm, rel=0.01)
+
+
+def test_prior_favours_the_nearest_multiple():
+    assert beattrack.estimate_tempo(impulse_train(240, smooth=True), FEATURE_RATE, prior_bpm=120) == pytest.approx(120, rel=0.01)
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import cache
+
+pytestmark = pytest.mark.skipif(not cache.available(), reason='pyarrow is not installed')
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path)
+    return tmp_path
+
+
+def test_save_and_load():
+    df = pd.DataFrame({'Onset': [0.5, 1.0, 1.5]})
+    cache.save('waltz', '0' * 64, df)
+    pd.testing.assert_frame_equal(cache.load('waltz', '0' * 64), df)
+    assert cache.load('waltz', '1' * 64) is None
+
+
+def test_save_replaces_stale_entries_of_the_same_piece_only(cache_dir):
+    df = pd.DataFrame({'Onset': [0.5]})
+    cache.save('waltz-auto', '0' * 64, df)
+    cache.save('waltz', '1' * 64, df)
+    cache.save('waltz', '2' * 64, df)
+    assert sorted(path.name for path in cache_dir.iterdir()) == ['waltz-2222222222222222.parquet', 'waltz-auto-0000000000000000.parquet']
+
+
+def test_clear_by_name(cache_dir):
+    df = pd.DataFrame({'Onset': [0.5]})
+    cache.save('waltz-auto', '0' * 64, df)
+    cache.save('waltz', '1' * 64, df)
+    cache.clear('waltz')
+    assert [path.name for path in cache_dir.iterdir()] == ['waltz-auto-0000000000000000.parquet']
+
+
+def test_failed_save_keeps_existing_entries(cache_dir, monkeypatch):
+    df = pd.DataFrame({'Onset': [0.5]})
+    cache.save('waltz', '1' * 64, df)
+
+    def to_parquet(self, path):
+        open(path, 'wb').write(b'PAR1')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', to_parquet)
+    with pytest.raises(OSError):
+        cache.save('waltz', '2' * 64, df)
+    assert [path.name for path in cache_dir.iterdir()] == ['waltz-1111111111111111.parquet']
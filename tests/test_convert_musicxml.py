@@ -0,0 +1,44 @@
+import pytest
+from music21 import meter, metadata, note, stream
+
+import convert_musicxml
+from convert_musicxml import convert_file
+
+
+def _write_score(path):
+    score = stream.Score()
+    score.metadata = metadata.Metadata(title='Test')
+    part = stream.Part()
+    measure = stream.Measure(number=1)
+    measure.timeSignature = meter.TimeSignature('3/4')
+    for pitch in ['C4', 'E4', 'G4']:
+        measure.append(note.Note(pitch, quarterLength=1))
+    part.append(measure)
+    score.insert(0, part)
+    score.write('musicxml', fp=path)
+
+
+def test_convert_file_writes_rb_without_leaving_temporary_files(tmp_path):
+    source = tmp_path / 'score.musicxml'
+    _write_score(source)
+    output_path = convert_file(source, use_cache=False)
+    assert output_path == tmp_path / 'score.rb'
+    assert output_path.read_text().startswith('$title = ')
+    assert 'add_note :C4' in output_path.read_text()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['score.musicxml', 'score.rb']
+
+
+def test_failed_conversion_keeps_existing_rb(tmp_path, monkeypatch):
+    source = tmp_path / 'score.musicxml'
+    _write_score(source)
+    (tmp_path / 'score.rb').write_text('previous\n')
+
+    def write_score(self, score, write, processes=1):
+        write('partial\n')
+        raise RuntimeError('conversion failed')
+
+    monkeypatch.setattr(convert_musicxml.MXLConverter, 'write_score', write_score)
+    with pytest.raises(RuntimeError):
+        convert_file(source, force=True, use_cache=False)
+    assert (tmp_path / 'score.rb').read_text() == 'previous\n'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['score.musicxml', 'score.rb']
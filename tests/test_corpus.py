@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+import corpus
+from piece import Piece
+
+
+def frames():
+    return {
+        'take1': pd.DataFrame({'Onset': [0.5, 1.0, 1.5], 'Cycle': np.array([1, 1, 2], dtype=np.int8)}),
+        'take2': pd.DataFrame({'Onset': [0.25, 0.75]}),
+    }
+
+
+def test_write_and_read(tmp_path):
+    path = tmp_path / 'piece.corpus'
+    corpus.write(path, frames(), {'take1': {'tempo_estimate': 180}}, source='abc')
+    data = corpus.Corpus(path)
+    assert data.names == ['take1', 'take2']
+    assert data.source == 'abc'
+    assert data.files[0]['metadata'] == {'tempo_estimate': 180}
+    # Columns missing from a file are filled with NaN, so are stored as floats
+    pd.testing.assert_frame_equal(data.frame(['take1']), frames()['take1'].astype({'Cycle': np.float64}))
+    np.testing.assert_array_equal(data.frame(['take2'])['Cycle'], [np.nan, np.nan])
+    np.testing.assert_array_equal(data.frame(['take1', 'take2'], ['Onset'])['Onset'], [0.5, 1.0, 1.5, 0.25, 0.75])
+
+
+def test_append_adds_files_and_keeps_source(tmp_path):
+    path = tmp_path / 'piece.corpus'
+    corpus.append(path, 'take1', frames()['take1'])
+    assert corpus.Corpus(path).source is None
+
+    corpus.write(path, frames(), source='abc')
+    corpus.append(path, 'take3', pd.DataFrame({'Onset': [2.0]}), {'penalty_factor': 0.5})
+    data = corpus.Corpus(path)
+    assert data.names == ['take1', 'take2', 'take3']
+    assert data.source == 'abc'
+    assert data.files[2]['metadata'] == {'penalty_factor': 0.5}
+
+
+def test_matches_compares_contents_only_when_modification_times_change(tmp_path, monkeypatch):
+    path = tmp_path / 'take1.csv'
+    path.write_text('Onset\n0.5\n')
+    source = corpus.fingerprint([path])
+    assert corpus.matches(source, [path])
+    assert not corpus.matches(source, [path, tmp_path / 'take2.csv'])
+
+    # An unchanged file is not read
+    with monkeypatch.context() as patch:
+        patch.setattr(corpus.Path, 'read_bytes', lambda path: pytest.fail('file was read'))
+        assert corpus.matches(source, [path])
+
+    # A fresh checkout of the same file has a new modification time
+    os.utime(path, (0, 0))
+    assert corpus.matches(source, [path])
+    # A change of the same size is found from the contents
+    path.write_text('Onset\n0.7\n')
+    assert not corpus.matches(source, [path])
+
+
+def test_piece_reads_appended_corpus_alongside_csv_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'waltz').mkdir(parents=True)
+    pd.DataFrame({'Onset': np.arange(12) * 0.5}).to_csv(tmp_path / 'data' / 'waltz' / 'manual.csv', index=False)
+    corpus.append(tmp_path / 'data' / 'waltz.corpus', 'auto', pd.DataFrame({'Onset': np.arange(12) * 0.4}))
+
+    piece = Piece('waltz', [2, 2, 2], use_cache=False)
+    assert [name for name, _ in piece._read_files(columns=['Onset'])] == ['manual', 'auto']
+    piece.load_from_onsets('Onset')
+    assert len(piece.df_list) == 2
+
+
+def test_piece_ignores_converted_corpus_once_csv_files_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'waltz').mkdir(parents=True)
+    csv_path = tmp_path / 'data' / 'waltz' / 'manual.csv'
+    pd.DataFrame({'Onset': np.arange(12) * 0.5}).to_csv(csv_path, index=False)
+    corpus.convert('waltz')
+
+    piece = Piece('waltz', [2, 2, 2], use_cache=False)
+    assert piece._corpus() is not None
+    pd.DataFrame({'Onset': np.arange(12) * 0.25}).to_csv(csv_path, index=False)
+    with pytest.warns(UserWarning, match='out of date'):
+        assert piece._corpus() is None
+
+
+def test_piece_ignores_corpus_in_an_older_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'waltz').mkdir(parents=True)
+    pd.DataFrame({'Onset': np.arange(12) * 0.5}).to_csv(tmp_path / 'data' / 'waltz' / 'manual.csv', index=False)
+    with monkeypatch.context() as patch:
+        patch.setattr(corpus, 'VERSION', corpus.VERSION - 1)
+        corpus.convert('waltz')
+
+    piece = Piece('waltz', [2, 2, 2], use_cache=False)
+    with pytest.warns(UserWarning, match='older corpus format'):
+        assert piece._corpus() is None
+
+
+@pytest.mark.skipif(not cache.available(), reason='pyarrow is not installed')
+def test_appending_to_corpus_invalidates_cached_piece(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'suku').mkdir(parents=True)
+    take = pd.DataFrame({'Onset_time': np.arange(4) * 0.5, 'Cycle_number': 1, 'Metric_location': [0, 0.3, 0.6, 1], 'Metric_location_index': [1, 2, 3, 4],
+                         'Phase': [0, 1 / 3, 2 / 3, 1], 'Is_included_in_grid': 1})
+    take.to_csv(tmp_path / 'data' / 'suku' / 'take.1_Jembe-1.csv', index=False)
+    corpus.convert('suku')
+    columns = ('Onset_time', 'Cycle_number', 'Metric_location', 'Metric_location_index', 'Is_included_in_grid', 'Phase')
+
+    def load():
+        piece = Piece('suku', [3, 3], use_cache=True)
+        piece.load_processed(*columns)
+        return piece
+
+    assert len(load().df_valid) == 4
+    corpus.append(tmp_path / 'data' / 'suku.corpus', 'take.2_Jembe-1', take)
+    assert len(load().df_valid) == 8
+
+
+def test_append_all_adds_several_files_at_once(tmp_path):
+    path = tmp_path / 'piece.corpus'
+    corpus.write(path, {'take1': frames()['take1']}, source='abc')
+    corpus.append_all(path, {'take1': frames()['take2'], 'take3': pd.DataFrame({'Onset': [2.0]})}, {'take3': {'tempo_estimate': 190}})
+    data = corpus.Corpus(path)
+    assert data.names == ['take1', 'take3']
+    assert data.source == 'abc'
+    np.testing.assert_array_equal(data.frame(['take1'], ['Onset'])['Onset'], [0.25, 0.75])
+    assert data.files[1]['metadata'] == {'tempo_estimate': 190}
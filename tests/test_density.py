@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from scipy.stats import gaussian_kde
+
+import density
+
+
+@pytest.mark.parametrize('bw_method', ['scott', 'silverman', 0.3])
+def test_estimate_matches_gaussian_kde(bw_method):
+    rng = np.random.default_rng(0)
+    samples_list = [rng.normal(0, 1, 500), np.concatenate([rng.normal(-1, 0.2, 100), rng.normal(1, 0.5, 300)]), rng.uniform(-0.5, 0.5, 40)]
+    for samples, (grid, pdf) in zip(samples_list, density.estimate(samples_list, bw_method=bw_method)):
+        assert grid[0] == samples.min() and grid[-1] == samples.max()
+        expected = gaussian_kde(samples, bw_method=bw_method)(grid)
+        # Linear binning moves each sample by at most one grid step, so the error is small next to the peak density
+        np.testing.assert_allclose(pdf, expected, atol=1e-3 * expected.max())
+
+
+def test_estimate_gives_nan_for_samples_without_spread():
+    (_, pdf), (_, normal_pdf) = density.estimate([np.ones(10), np.arange(10.0)], points=50)
+    assert np.isnan(pdf).all()
+    assert np.isfinite(normal_pdf).all()
+
+
+def test_resample_is_reproducible_with_a_random_state():
+    samples = np.arange(20.0)
+    first = density.resample(samples, 100, random_state=np.random.RandomState(1))
+    second = density.resample(samples, 100, random_state=np.random.RandomState(1))
+    np.testing.assert_array_equal(first, second)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+import loader
+
+
+def test_whole_numbers_are_downcast_to_integers():
+    df = loader.downcast(pd.DataFrame({'Is_included_in_grid': [1.0, 0.0, 1.0], 'Metric_location_index': [1, 2, 12]}))
+    assert df['Is_included_in_grid'].dtype == np.int8
+    assert df['Metric_location_index'].dtype == np.int8
+
+
+def test_whole_numbers_with_missing_values_are_downcast_to_float32():
+    df = loader.downcast(pd.DataFrame({'Cycle_number': [1.0, np.nan, 3.0]}))
+    assert df['Cycle_number'].dtype == np.float32
+
+
+def test_fractional_values_keep_float64():
+    # 0.5 and 1.25 are exact in float32, but arithmetic on onsets and phases needs float64
+    df = loader.downcast(pd.DataFrame({'Onset': [0.5, 1.25, 2.0], 'Phase': [0.1, np.nan, 0.7]}))
+    assert df['Onset'].dtype == np.float64
+    assert df['Phase'].dtype == np.float64
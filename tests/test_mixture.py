@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import mixture
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(mixture.cache, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(mixture, '_models', {})
+    monkeypatch.setattr(mixture, '_pruned', False)
+    return tmp_path
+
+
+def samples(seed):
+    random_state = np.random.RandomState(seed)
+    return np.concatenate([random_state.normal(-1, 0.2, 100), random_state.normal(1, 0.3, 100)])
+
+
+def test_fit_is_memoized_and_stored_as_parameters(cache_dir):
+    model = mixture.fit(samples(0))
+    assert mixture.fit(samples(0)) is model
+    assert [path.suffix for path in cache_dir.iterdir()] == ['.npz']
+
+    mixture._models.clear()
+    loaded = mixture.lookup(samples(0))
+    grid = np.linspace(-2, 2, 50).reshape(-1, 1)
+    np.testing.assert_allclose(loaded.score_samples(grid), model.score_samples(grid))
+
+
+def test_warm_start_is_memoized_separately():
+    previous = mixture.fit(samples(1), persist=False)
+    cold = mixture.fit(samples(0), persist=False)
+    warm = mixture.fit(samples(0), previous=previous, persist=False)
+    assert warm is not cold
+    assert mixture.fit(samples(0), persist=False) is cold
+    assert mixture.lookup(samples(0), persist=False, previous=previous) is warm
+
+
+def test_cache_is_pruned_once_per_process(cache_dir, monkeypatch):
+    monkeypatch.setattr(mixture, 'MAX_CACHED_MODELS', 2)
+    for seed in range(4):
+        mixture.fit(samples(seed))
+    assert len(list(cache_dir.glob('mixture-*.npz'))) == 4
+
+    # The first save of a new process removes the oldest models beyond the limit
+    monkeypatch.setattr(mixture, '_pruned', False)
+    mixture.fit(samples(4))
+    assert len(list(cache_dir.glob('mixture-*.npz'))) == 2
+    assert mixture.lookup(samples(4)) is not None
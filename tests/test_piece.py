@@ -0,0 +1,164 @@
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import piece
+from piece import Piece
+
+
+# Writes a take of onsets for a piece called name under data/ in the working directory
+def write_onsets(name, take, onsets):
+    directory = Path('data') / name
+    directory.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame({'TIME': onsets}).to_csv(directory / f'{take}.csv', index=False)
+
+
+def test_load_without_defer_does_nothing():
+    piece = Piece('waltz', [2, 2, 2], use_cache=False)
+    piece.load()
+    assert not hasattr(piece, 'df')
+
+
+def test_deferred_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_onsets('waltz', 'take1', np.arange(0, 12, 0.5))
+    piece = Piece('waltz', [2, 2, 2], use_cache=False).defer('load_from_onsets', 'TIME')
+    assert 'df' not in piece.__dict__
+    assert set(piece.df['Metric_location']) == {0, 1, 2}
+    assert piece.cycle_num == 'Cycle_number'
+
+
+class SlowPiece(Piece):
+
+    # Publishes a frame and then modifies it, as load_processed does when normalizing
+    def load_slowly(self, started, release):
+        self.df = pd.DataFrame({'Phase': [1.0, 2.0]})
+        started.set()
+        release.wait()
+        self.df['Phase'] = self.df['Phase'] * 3
+
+
+def test_background_load_publishes_finished_data():
+    started, release = threading.Event(), threading.Event()
+    piece = SlowPiece('slow', [3]).defer('load_slowly', started, release)
+    thread = piece.load(background=True)
+    started.wait()
+    assert 'df' not in piece.__dict__
+
+    result = []
+    reader = threading.Thread(target=lambda: result.append(piece.df['Phase'].tolist()))
+    reader.start()
+    release.set()
+    reader.join()
+    thread.join()
+    assert result == [[3.0, 6.0]]
+
+
+def test_tempo_curve_bins_beats_by_rounded_progress():
+    onsets = np.cumsum(np.random.RandomState(0).uniform(0.3, 0.5, 2000))
+    grid, tempo, average_tempo, duration = piece._tempo_curve(onsets, 0.1, 10)
+
+    # Reference: round progress to 1 decimal place and average the beats in each bin with pandas
+    df = pd.DataFrame({'Tempo': 60 / pd.Series(onsets).diff(), 'Progress': ((onsets - onsets[0]) / (onsets[-1] - onsets[0]) * 100).round(1)})
+    expected = df.groupby('Progress')['Tempo'].mean()
+    np.testing.assert_array_equal(grid, expected.index)
+    np.testing.assert_allclose(tempo, expected, rtol=1e-12)
+    np.testing.assert_allclose(average_tempo, expected.rolling(10).mean(), rtol=1e-12)
+    assert duration == onsets[-1] - onsets[0]
+
+
+# Writes a processed take of one instrument for a piece called name under data/ in the working directory,
+# labelling each metric location as its beat plus its pulse unit within the beat in tenths (e.g. 1.3 for the fourth pulse unit of the second beat)
+# The onsets are on consecutive pulse units of the first cycle, unless pulses gives the pulse unit of each counted from the start of the take
+def write_processed(name, take, instrument, onsets, beat_division, pulses=None, pulse_units=None):
+    directory = Path('data') / name
+    directory.mkdir(parents=True, exist_ok=True)
+    pulses = np.arange(len(onsets)) if pulses is None else pulses
+    cycles = 1 if pulse_units is None else pulses // pulse_units + 1
+    pulses = pulses if pulse_units is None else pulses % pulse_units
+    pd.DataFrame({
+        'Onset_time': onsets,
+        'Cycle_number': cycles,
+        'Metric_location': pulses // beat_division + (pulses % beat_division) / 10,
+        'Metric_location_index': pulses + 1,
+        'Phase': pulses / beat_division,
+        'Is_included_in_grid': 1,
+    }).to_csv(directory / f'take.{take}_{instrument}.csv', index=False)
+
+
+PROCESSED_COLUMNS = ('Onset_time', 'Cycle_number', 'Metric_location', 'Metric_location_index', 'Is_included_in_grid', 'Phase')
+
+
+def test_asynchronies_align_onsets_by_metric_location_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # With four pulse units per beat, rounding these metric locations to pulse units would merge 0, 0.1 and 0.2
+    onsets = np.arange(8) * 0.25
+    write_processed('async', 1, 'Dundun-1', onsets, 4)
+    write_processed('async', 1, 'Jembe-1', onsets + np.arange(8) / 100, 4)
+    piece = Piece('async', [4, 4], use_cache=False)
+    piece.load_processed(*PROCESSED_COLUMNS)
+    result = piece.asynchronies().sort_values('Metric_location')
+    assert len(result) == 8
+    assert result['Metric_location'].tolist() == [0, 0.1, 0.2, 0.3, 1, 1.1, 1.2, 1.3]
+    np.testing.assert_allclose(result['Asynchrony'], np.arange(8) / 100)
+
+
+def test_asynchronies_warn_about_duplicate_onsets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_processed('async', 1, 'Dundun-1', np.arange(6) * 0.25, 3)
+    write_processed('async', 1, 'Jembe-1', np.arange(6) * 0.25, 3)
+    path = Path('data') / 'async' / 'take.1_Jembe-1.csv'
+    df = pd.read_csv(path)
+    pd.concat([df, df.iloc[[2]]]).to_csv(path, index=False)
+    piece = Piece('async', [3, 3], use_cache=False)
+    piece.load_processed(*PROCESSED_COLUMNS)
+    with pytest.warns(UserWarning, match='Jembe1 has 1 onsets'):
+        result = piece.asynchronies()
+    assert len(result) == 6
+
+
+def test_onset_phases_snap_window_keeps_metric_locations_after_a_missing_beat():
+    onsets = np.arange(30) * 0.5
+    missing = 10
+    played = np.delete(onsets, missing)
+    _, rows, cycles, locs, offsets = piece._onset_phases(played, np.array([len(played)]), 3, 2, snap_window=5)
+    # Each onset keeps the cycle and metric location it has without the gap, and the filled beat is not returned as an onset
+    original = np.delete(np.arange(30), missing)[rows]
+    np.testing.assert_array_equal(cycles, original // 3 + 1)
+    np.testing.assert_array_equal(locs, original % 3)
+    np.testing.assert_allclose(offsets, 0, atol=1e-9)
+    assert missing not in original
+
+    # Without snap_window, the onset after the gap takes the missing beat's metric location
+    _, rows, _, locs, _ = piece._onset_phases(played, np.array([len(played)]), 3, 2)
+    assert locs[rows == missing] == [missing % 3]
+
+
+def test_load_from_onsets_numbers_dataframes_without_files_as_takes(monkeypatch):
+    monkeypatch.setattr(piece.plt, 'show', lambda: None)
+    random_state = np.random.RandomState(0)
+    dfs = [pd.DataFrame({'TIME': np.arange(30) * 0.5 + random_state.normal(0, 0.01, 30)}) for _ in range(2)]
+    waltz = Piece('waltz', [2, 2, 2], use_cache=False)
+    waltz.load_from_onsets('TIME', dfs=dfs)
+    assert waltz.files['Take'].tolist() == [1, 2]
+    assert len(waltz.select(take=2)) == len(waltz.df_list[1])
+    result = waltz.statistical_test(1)
+    assert result['Piece'].tolist() == ['take-1', 'take-2']
+
+
+def test_joint_rhythm_sequence_is_reproducible_with_a_random_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    random_state = np.random.RandomState(0)
+    for instrument in ['Dundun-1', 'Jembe-1']:
+        for take in [1, 2]:
+            pulses = np.flatnonzero(random_state.random_sample(120) < 0.6)
+            write_processed('joint', take, instrument, pulses * 0.2, 3, pulses, 12)
+    joint = Piece('joint', [3, 3, 3, 3], use_cache=False)
+    joint.load_processed(*PROCESSED_COLUMNS)
+    first = joint.joint_rhythm_sequence('Jembe-1', 'Dundun-1', 20, int_output=True, random_state=np.random.RandomState(3))
+    second = joint.joint_rhythm_sequence('Jembe-1', 'Dundun-1', 20, int_output=True, random_state=np.random.RandomState(3))
+    assert first == second
+    assert len(first[0]) == len(first[1]) == 21
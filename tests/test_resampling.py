@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import resampling
+from piece import Piece
+
+
+def waltz():
+    random_state = np.random.RandomState(0)
+    dfs = [pd.DataFrame({'Onset': np.cumsum(random_state.normal(0.5, 0.02, 61))}) for _ in range(2)]
+    piece = Piece('waltz', [2, 2, 2], use_cache=False)
+    piece.load_from_onsets('Onset', dfs=dfs)
+    return piece
+
+
+def test_bootstrap_is_reproducible_whatever_the_number_of_processes():
+    piece = waltz()
+    serial = piece.bootstrap(by=['File'], num_resamples=2500, seed=1, processes=1)
+    pd.testing.assert_frame_equal(piece.bootstrap(by=['File'], num_resamples=2500, seed=1, processes=1), serial)
+    pd.testing.assert_frame_equal(piece.bootstrap(by=['File'], num_resamples=2500, seed=1, processes=2), serial)
+    assert not serial.equals(piece.bootstrap(by=['File'], num_resamples=2500, seed=2, processes=1))
+    assert (serial['CI lower'] <= serial['Mean']).all() and (serial['Mean'] <= serial['CI upper']).all()
+
+
+def test_permutation_test_is_reproducible_whatever_the_number_of_processes():
+    piece = waltz()
+    serial = piece.permutation_test(num_resamples=2500, seed=1, processes=1)
+    pd.testing.assert_frame_equal(piece.permutation_test(num_resamples=2500, seed=1, processes=1), serial)
+    pd.testing.assert_frame_equal(piece.permutation_test(num_resamples=2500, seed=1, processes=2), serial)
+    assert not serial.equals(piece.permutation_test(num_resamples=2500, seed=2, processes=1))
+
+
+def test_permutation_test_finds_a_difference_in_means():
+    random_state = np.random.RandomState(0)
+    a, b = random_state.normal(0, 0.2, 40), random_state.normal(1, 0.2, 40)
+    (observed, p_value), (_, same_p_value) = resampling.permutation_test([(a, b), (a, a)], num_resamples=999, chunk_size=250, processes=1)
+    assert observed == a.mean() - b.mean()
+    assert p_value == 1 / 1000
+    assert same_p_value == 1
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+import rhythm
+
+
+# Returns the frequency of each state drawn from context of table, using an evenly spaced grid of steps x steps pairs of uniform random numbers
+def draw_frequencies(table, context, states, steps=400):
+    grid = (np.arange(steps) + 0.5) / steps
+    draws = np.array([table.draw(context, r1, r2) for r1 in grid for r2 in grid])
+    return np.array([np.mean(draws == state) for state in range(states)])
+
+
+def test_alias_tables_draw_states_in_proportion_to_transition_counts():
+    contexts = np.array([0] * 10 + [1] * 3)
+    states = np.array([0, 1, 1, 2, 2, 2, 3, 3, 3, 3, 2, 2, 2])
+    table = rhythm._TransitionTable(contexts, states, (3, 4))
+    np.testing.assert_allclose(draw_frequencies(table, 0, 4), [0.1, 0.2, 0.3, 0.4], atol=0.005)
+    np.testing.assert_allclose(draw_frequencies(table, 1, 4), [0, 0, 1, 0])
+    # A context which was never followed by a state has nothing to draw
+    assert table.draw(2, 0.5, 0.5) == -1
+
+
+def test_markov_chain_samples_transitions_in_proportion_to_counts():
+    patterns = np.array([5, 6, 5, 7, 5, 7, 5, 7, 5, 6])
+    index = pd.MultiIndex.from_arrays([np.ones(len(patterns)), np.arange(len(patterns))], names=['Take', 'Cycle'])
+    chain = rhythm.MarkovChain(patterns, rhythm.first_cycles(pd.Series(patterns, index=index)))
+    sample = chain.sample(20000, random_state=np.random.RandomState(0))
+    after_five = sample[1:][sample[:-1] == 5]
+    # 5 is followed by 6 twice and by 7 three times
+    assert abs(np.mean(after_five == 6) - 0.4) < 0.02
+    assert set(sample[1:][sample[:-1] != 5]) == {5}
+
+
+
+def test_context_model_backs_off_to_the_longest_observed_suffix():
+    model = rhythm.ContextModel([np.array([1, 2, 1, 3])], order=2)
+    index = {state: i for i, state in enumerate(model.states)}
+    # Context values are given most recent first: 2 then 1 was seen (followed by 1), 1 then 1 was not, and 3 was never followed by anything
+    assert len(model._context_ids([index[2], index[1]])) == 3
+    assert len(model._context_ids([index[1], index[1]])) == 2
+    assert len(model._context_ids([index[3], index[1]])) == 1
+
+    # After 1, the next state is 2 or 3 whatever came before it
+    ids = model._context_ids([index[1], index[1]])
+    frequencies = draw_frequencies(model._tables[len(ids) - 1], ids[-1], len(model.states))
+    np.testing.assert_allclose(frequencies, [0, 0.5, 0.5], atol=0.005)
+    # With no observed context, states are drawn from the unconditional distribution
+    frequencies = draw_frequencies(model._tables[0], 0, len(model.states))
+    np.testing.assert_allclose(frequencies, [0.5, 0.25, 0.25], atol=0.005)
+
+
+def test_context_model_backs_off_for_unseen_conditions():
+    model = rhythm.ContextModel([np.array([1, 2, 1, 2])], order=1, conditions=[np.array([10, 20, 10, 20])])
+    drawn = set()
+    for seed in range(20):
+        sequence = model.sample(4, np.array([10, 20, 99, 10]), random_state=np.random.RandomState(seed))
+        # Seen conditions determine the pattern, and 10 follows either pattern with 1
+        assert sequence[[0, 1, 3]].tolist() == [1, 2, 1]
+        drawn.add(sequence[2])
+    # The unseen condition 99 backs off to the unconditional distribution
+    assert drawn == {1, 2}
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from piece import Piece
+
+
+def test_stream_matches_load_from_onsets():
+    onsets = np.cumsum(np.random.RandomState(0).normal(0.5, 0.02, 61))
+    waltz = Piece('waltz', [2, 2, 2], use_cache=False)
+    waltz.load_from_onsets('Onset', dfs=[pd.DataFrame({'Onset': onsets})])
+
+    stream = waltz.stream()
+    assert stream.push(onsets[0]).empty
+    frames = [stream.extend(chunk) for chunk in np.split(onsets[1:], [3, 4, 30])]
+    actual = pd.concat(frames, ignore_index=True)
+    # The stream only emits complete cycles, whereas load_from_onsets also keeps the first beat of the last one
+    assert actual['Cycle_number'].max() == stream.cycles == 20
+    columns = ['Onset', 'Cycle_number', 'Metric_location', 'Offset', 'Phase', 'Is_included_in_grid']
+    expected = waltz.df[waltz.df['Cycle_number'] <= 20][columns].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual[columns], expected, check_dtype=False)
+
+    stats = stream.stats()
+    grouped = actual.groupby('Metric_location')['Offset']
+    np.testing.assert_allclose(stats['Mean'], grouped.mean())
+    np.testing.assert_allclose(stats['Standard deviation'], grouped.std())
+    assert stats['Count'].tolist() == [20, 20, 20]
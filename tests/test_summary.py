@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import summary
+from piece import Piece
+from summary import Summary
+
+
+def test_update_and_merge_match_batch_summary():
+    values = np.random.RandomState(0).normal(0, 1, 50)
+    batch = Summary.of(values)
+    updated = Summary()
+    for value in values[:20]:
+        updated.update(value)
+    merged = updated + Summary.of(values[20:])
+    assert merged.count == batch.count
+    np.testing.assert_allclose([merged.mean, merged.m2], [batch.mean, batch.m2])
+    np.testing.assert_allclose(merged.stddev(), np.std(values, ddof=1))
+    assert np.isnan(Summary.of(values[:1]).stddev())
+
+
+def test_merged_take_summaries_match_mle():
+    random_state = np.random.RandomState(0)
+    dfs = [pd.DataFrame({'Onset': np.cumsum(random_state.normal(0.5, 0.02, length))}) for length in [31, 46, 61]]
+    waltz = Piece('waltz', [2, 2, 2], use_cache=False)
+    waltz.load_from_onsets('Onset', dfs=dfs)
+
+    # Summaries of each take, as they would be computed by separate workers, merged by metric location
+    takes = {}
+    for (file, location), location_summary in waltz.summaries(by=['File']).items():
+        takes.setdefault(file, {})[location] = location_summary
+    merged = summary.merge_all(takes.values())
+    assert set(merged) == {0, 1, 2}
+    pd.testing.assert_frame_equal(waltz.summary_table(merged), waltz.mle(), check_dtype=False)
@@ -0,0 +1,39 @@
+import numpy as np
+from scipy.optimize import curve_fit
+
+import tempofit
+
+PARAMS = [8, 5, 100, 0.01, -1.5, 180]
+
+
+# Returns noisy samples of the tempo model with a cutoff at 60, in shuffled order
+def samples(seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.permutation(np.linspace(0, 100, 400))
+    return x, tempofit.combined(x, 60, *PARAMS) + rng.normal(0, 0.5, len(x))
+
+
+def test_fit_at_cutoff_is_at_least_as_good_as_curve_fit():
+    x, y = samples()
+    popt, pcov, residuals, cutoff = tempofit.fit(x, y, cutoff=60)
+    assert cutoff == 60
+    np.testing.assert_allclose(residuals, y - tempofit.combined(x, 60, *popt))
+    assert pcov.shape == (6, 6) and np.isfinite(pcov).all()
+
+    expected, _ = curve_fit(lambda x, a, b, c, d, e, f: tempofit.combined(x, 60, a, b, c, d, e, f), x, y, p0=[1, 1, 1, 0, 0, 0], maxfev=10000)
+    expected_residuals = y - tempofit.combined(x, 60, *expected)
+    assert np.sum(residuals**2) <= np.sum(expected_residuals**2) * (1 + 1e-6)
+
+
+def test_fit_finds_the_cutoff():
+    x, y = samples(1)
+    popt, _, _, cutoff = tempofit.fit(x, y, min_cutoff=20, max_cutoff=90)
+    assert abs(cutoff - 60) < 2
+    np.testing.assert_allclose(popt[3:], PARAMS[3:], rtol=0.2)
+
+
+def test_fit_with_too_few_points_gives_nan():
+    x, y = samples()
+    popt, pcov, residuals, cutoff = tempofit.fit(x, y, cutoff=-1)
+    assert np.isnan(popt).all() and np.isnan(pcov).all() and np.isnan(residuals).all()
+    assert cutoff == -1